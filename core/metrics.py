@@ -0,0 +1,179 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """In-process request metrics, keyed by (view, action, method).
+
+    Every worker process keeps its own registry; Prometheus scrapes and
+    sums them per instance.
+    """
+
+    histograms = {
+        "http_request_duration_seconds": ("Request latency.", LATENCY_BUCKETS),
+        "http_request_db_queries": ("Database queries per request.", QUERY_BUCKETS),
+        "http_response_size_bytes": ("Response body size.", SIZE_BUCKETS),
+    }
+    counters = {
+        "http_requests_total": "Requests served, by status code.",
+        "http_request_errors_total": "Requests that failed with a 5xx or an exception.",
+        "http_request_db_seconds_total": "Time spent in database queries.",
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.series = {name: {} for name in (*self.histograms, *self.counters)}
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            series = self.series[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self.histograms[name][1])
+            histogram.observe(value)
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            series = self.series[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, (help_text, buckets) in self.histograms.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for labels, histogram in sorted(self.series[name].items()):
+                    cumulative = 0
+                    for bound, count in zip((*buckets, "+Inf"), histogram.counts):
+                        cumulative += count
+                        bucket_labels = (*labels, ("le", bound))
+                        lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+            for name, help_text in self.counters.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for labels, value in sorted(self.series[name].items()):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+        if psutil is not None:
+            memory = psutil.Process().memory_info()
+            lines += [
+                "# HELP process_resident_memory_bytes Resident memory size.",
+                "# TYPE process_resident_memory_bytes gauge",
+                f"process_resident_memory_bytes {memory.rss}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+registry = Registry()
+
+
+class QueryCounter:
+    """``execute_wrapper`` hook counting and timing the queries it sees."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """Record latency, query count, DB time, response size and errors per view action."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(queries):
+                response = self.get_response(request)
+        except Exception:
+            self.record(request, 500, start, queries, None)
+            raise
+        self.record(request, response.status_code, start, queries, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Router-generated viewset views map HTTP methods to actions.
+        actions = getattr(view_func, "actions", None) or {}
+        request.metrics_action = actions.get(request.method.lower(), "")
+
+    def record(self, request, status_code, start, queries, response):
+        match = request.resolver_match
+        labels = (
+            ("view", match.view_name if match else "unmatched"),
+            ("action", getattr(request, "metrics_action", "")),
+            ("method", request.method),
+        )
+        registry.observe("http_request_duration_seconds", labels, time.perf_counter() - start)
+        registry.observe("http_request_db_queries", labels, queries.count)
+        registry.inc("http_request_db_seconds_total", labels, queries.duration)
+        registry.inc("http_requests_total", (*labels, ("status", status_code)))
+        if status_code >= 500:
+            registry.inc("http_request_errors_total", labels)
+        if response is not None and not response.streaming:
+            registry.observe("http_response_size_bytes", labels, len(response.content))
+
+
+def metrics_view(request):
+    """Prometheus scrape target, for staff sessions or ``Bearer <METRICS_TOKEN>``."""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get("Authorization", "")
+    allowed = request.user.is_staff or bool(
+        token and hmac.compare_digest(authorization, f"Bearer {token}")
+    )
+    if not allowed:
+        raise Http404
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
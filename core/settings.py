@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "crum.CurrentRequestUserMiddleware",
@@ -100,6 +101,40 @@ DATABASES = {
 }
 
 
+# Cache
+# django-redis when REDIS_URL is set, so cached responses and purchase
+# replays are shared by all workers; per-process memory otherwise.
+# REDIS_URL is required in production: a per-process cache never sees
+# the invalidations other workers make.
+
+REDIS_URL = env("REDIS_URL", default=None)
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Seconds a cached product catalog response lives at most; product saves
+# and stock flips invalidate it earlier. Without Redis an invalidation
+# only reaches the worker that made it, so entries and the catalog
+# version (which the catalog ETags hash) only live a few seconds.
+CATALOG_CACHE_TIMEOUT: int = env.int(
+    "CATALOG_CACHE_TIMEOUT", default=60 * 60 if REDIS_URL else 5)
+CATALOG_VERSION_TIMEOUT = None if REDIS_URL else CATALOG_CACHE_TIMEOUT
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -149,6 +184,40 @@ REST_FRAMEWORK = {
 }
 
 
+# Purchases
+# Seconds a purchase response is kept for replay to a retrying client.
+PURCHASE_REPLAY_TIMEOUT: int = env.int("PURCHASE_REPLAY_TIMEOUT", default=300)
+# Upper bound on how long a purchase may hold its transaction id in flight.
+PURCHASE_LOCK_TIMEOUT: int = env.int("PURCHASE_LOCK_TIMEOUT", default=30)
+# Seconds closed-range report results stay cached.
+REPORT_CACHE_TIMEOUT: int = env.int("REPORT_CACHE_TIMEOUT", default=24 * 60 * 60)
+# Seconds between refreshes of an open low stock notification's message.
+LOW_STOCK_DEBOUNCE: int = env.int("LOW_STOCK_DEBOUNCE", default=60)
+
+
+# Monitoring
+# Bearer token for scraping /metrics; staff sessions can always read it.
+METRICS_TOKEN = env("METRICS_TOKEN", default=None)
+# Return per-phase Server-Timing headers on the purchase path and log them.
+SERVER_TIMING: bool = env.bool("SERVER_TIMING", default=False)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "root": {
+        "handlers": ["console"],
+        "level": env("LOG_LEVEL", default="WARNING"),
+    },
+    "loggers": {
+        # One JSON line per timed request, only emitted with SERVER_TIMING on.
+        "core.timing": {"level": "INFO"},
+    },
+}
+
+
 ACCOUNT_AUTHENTICATION_METHOD = "username"
 ACCOUNT_EMAIL_REQUIRED = False
 ACCOUNT_EMAIL_VERIFICATION = "none"  # "mandatory", "optional", or "none"
@@ -0,0 +1,87 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from crum import get_current_request
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTiming:
+    """Wall-clock time spent in the named phases of one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def milliseconds(self):
+        timings = {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()}
+        timings["total"] = round((time.perf_counter() - self.start) * 1000, 2)
+        return timings
+
+    def header(self, timings):
+        return ", ".join(f"{name};dur={duration}" for name, duration in timings.items())
+
+
+@contextmanager
+def phase(name):
+    """Time the enclosed block as ``name`` when the current request is being timed.
+
+    A no-op outside timed requests, so service code can be instrumented
+    unconditionally.
+    """
+    timing = getattr(get_current_request(), "server_timing", None)
+    if timing is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+class ServerTimingMixin:
+    """Break a view's time down into phases when ``SERVER_TIMING`` is on.
+
+    Authentication (with permission and throttle checks) and rendering
+    are timed here; service code marks its own phases with :func:`phase`.
+    The result is returned in the ``Server-Timing`` header and logged as
+    one JSON line.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        if not settings.SERVER_TIMING:
+            return super().initial(request, *args, **kwargs)
+
+        # Kept on the Django request, which is what crum hands to phase().
+        request._request.server_timing = ServerTiming()
+        with phase("auth"):
+            super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timing = getattr(request, "server_timing", None)
+        if timing is None:
+            return response
+
+        with phase("render"):
+            response.render()
+        timings = timing.milliseconds()
+        response["Server-Timing"] = timing.header(timings)
+        logger.info(json.dumps({
+            "event": "server_timing",
+            "view": type(self).__name__,
+            "action": getattr(self, "action", None),
+            "method": request.method,
+            "status": response.status_code,
+            "user": getattr(request.user, "pk", None),
+            "phases": timings,
+        }))
+        return response
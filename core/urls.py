@@ -9,6 +9,8 @@ from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 from rest_framework.routers import DefaultRouter
 
+from core.metrics import metrics_view
+
 admin.site.site_title = "original-softwere-fib"
 admin.site.site_header = "original-softwere-fib"
 admin.site.index_title = "Admin Panal"
@@ -43,6 +45,7 @@ urlpatterns = [
     path("", include("authentication.urls")),
     
     path("admin/", admin.site.urls),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 if settings.DEBUG:
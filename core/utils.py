@@ -1,10 +1,26 @@
-from rest_framework.views import exception_handler
+import hashlib
+import logging
+
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
 from rest_framework.renderers import JSONRenderer
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
 
 
 def custom_exception_handler(exc, context):
     """Format all errors to match {'status': False, 'message': 'Failed reason'}"""
+    # Imported here: rest_framework.views resolves DEFAULT_RENDERER_CLASSES,
+    # which points back at this module.
+    from rest_framework.views import exception_handler
+
     response = exception_handler(exc, context)
 
     if response is not None:
@@ -14,7 +30,13 @@ def custom_exception_handler(exc, context):
         if len(response.data.values()) > 1:
             transaction = list(response.data.values())[1] if isinstance(
             response.data, dict) else str(response.data)
-        print(response.data)
+        request = context.get("request")
+        logger.log(
+            logging.ERROR if response.status_code >= 500 else logging.INFO,
+            "%s %s failed with %s: %s",
+            request and request.method, request and request.path,
+            response.status_code, response.data,
+        )
 
         if transaction:
             response.data = {
@@ -31,25 +53,94 @@ def custom_exception_handler(exc, context):
     return response
 
 
+SUCCESS_ENVELOPE = b'{"status":true,"message":"Success"'
+
+
 class CustomJSONRenderer(JSONRenderer):
+    """Wrap every payload in the ``{"status", "message"}`` envelope.
+
+    Dict payloads are merged into the envelope, anything else (lists,
+    scalars) goes under ``"data"``. The payload is encoded once, with
+    orjson when it is installed, and spliced into the envelope bytes
+    instead of being copied into a new dict first.
+    """
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
-        # If there's already a response structure, return as is
-        response = {
-            "status": True,
-            "message": "Success",
-            **data
-        }
-
-        if isinstance(data, dict) and "error" in data:
-            response["status"] = False
-            response["message"] = data.get("error", "Error")
-
-        return super().render(response, accepted_media_type, renderer_context)
-    
-    
+        if data is None:
+            return b""
+
+        if isinstance(data, dict) and ({"status", "message", "error"} & data.keys()):
+            # The payload carries its own envelope fields: merge them the slow way.
+            response = {
+                "status": True,
+                "message": "Success",
+                **data
+            }
+            if "error" in data:
+                response["status"] = False
+                response["message"] = data.get("error", "Error")
+            return self.encode(response, accepted_media_type, renderer_context)
+
+        payload = self.encode(data, accepted_media_type, renderer_context)
+        if not isinstance(data, dict):
+            return SUCCESS_ENVELOPE + b',"data":' + payload + b"}"
+        if not data:
+            return SUCCESS_ENVELOPE + b"}"
+        return SUCCESS_ENVELOPE + b"," + payload.lstrip()[1:]
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(
+            data, default=self.encoder_class().default, option=orjson.OPT_NON_STR_KEYS)
+
+
 class StandardLimitOffsetPagination(PageNumberPagination):
     page_size = 25
     page_size_query_param = "page_size"
     max_page_size = 100
 
 
+class OrderLinesCursorPagination(CursorPagination):
+    """Keyset pagination over (created, id): no COUNT, no OFFSET scan."""
+
+    ordering = ("created", "id")
+    page_size = 25
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class ConditionalGetMixin:
+    """Answer unchanged GETs with 304 before running the serializer.
+
+    Views implement ``get_version_stamp(request)`` returning a cheap stamp
+    that changes whenever their data does, and optionally
+    ``get_last_modified(request)``, only if it moves whenever the stamp
+    does. The strong ETag hashes the stamp with the full URL, so each
+    page and filter has its own.
+    """
+
+    def get_version_stamp(self, request):
+        raise NotImplementedError
+
+    def get_last_modified(self, request):
+        return None
+
+    def conditional(self, request, render):
+        stamp = f"{self.get_version_stamp(request)}:{request.get_full_path()}"
+        etag = quote_etag(hashlib.sha256(stamp.encode()).hexdigest())
+        last_modified = self.get_last_modified(request)
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            fresh = etag in parse_etags(if_none_match) or if_none_match.strip() == "*"
+        else:
+            since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+            fresh = bool(since and last_modified and int(last_modified.timestamp()) <= since)
+
+        response = Response(status=status.HTTP_304_NOT_MODIFIED) if fresh else render()
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response["ETag"] = etag
+            if last_modified:
+                response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
@@ -128,6 +128,7 @@ class ProductAdmin(admin.ModelAdmin):
         # "qty_modified_from_zero",
     )
     list_display_links = ("id", "product_name")
+    list_select_related = ("product_id",)
     list_filter = (
         "product_id",
     )
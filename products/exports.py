@@ -0,0 +1,134 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError as drf_exceptions
+
+from .models import Order, OrderLines
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def filter_order_lines(queryset, params):
+    """Apply the created_after, created_before and username report filters in ``params``."""
+    start_date = params.get("created_after")
+    end_date = params.get("created_before")
+    username = params.get("username")
+
+    if start_date:
+        try:
+            start_date = parse_date(start_date)
+            if not start_date:
+                raise ValueError
+        except ValueError:
+            raise drf_exceptions(
+                {"created_after": "Invalid date format. Use YYYY-MM-DD."}
+            )
+        queryset = queryset.filter(created__gte=start_date)
+
+    if end_date:
+        try:
+            end_date = parse_date(end_date)
+            if not end_date:
+                raise ValueError
+        except ValueError:
+            raise drf_exceptions(
+                {"created_before": "Invalid date format. Use YYYY-MM-DD."}
+            )
+        queryset = queryset.filter(created__lte=end_date)
+
+    if username:
+        queryset = queryset.filter(
+            created_by__username__icontains=username)
+
+    return queryset
+
+
+def _line_rows(queryset):
+    fields = (
+        "id", "order_id", "order__transaction_id", "created", "created_by__username",
+        "product_key_id", "product_key__serial_no_value", "product_key__pin",
+        "product_key__product_id", "product_key__product__name", "order__unit_price",
+    )
+    for (line_id, order_id, transaction_id, created, username, key_id, serial_no,
+         pin, product_id, name, price) in queryset.values_list(*fields).iterator(CHUNK_SIZE):
+        yield {
+            "id": line_id,
+            "order": order_id,
+            "transaction_id": transaction_id,
+            "created": created,
+            "created_by": username,
+            "serial_no": serial_no or f"SN-{key_id:06d}-{product_id:04d}",
+            "pin": pin,
+            "product_id": product_id,
+            "name": name,
+            "price": price,
+        }
+
+
+def _order_rows(queryset):
+    fields = (
+        "id", "transaction_id", "created", "created_by__username",
+        "product_id_id", "product_id__name", "unit_price", "quantity",
+    )
+    for (order_id, transaction_id, created, username, product_id, name, price,
+         quantity) in queryset.values_list(*fields).iterator(CHUNK_SIZE):
+        yield {
+            "id": order_id,
+            "transaction_id": transaction_id,
+            "created": created,
+            "created_by": username,
+            "product_id": product_id,
+            "name": name,
+            "price": price,
+            "quantity": quantity,
+            "total_price": price * quantity if price is not None else None,
+        }
+
+
+EXPORTS = {
+    "lines": (OrderLines, _line_rows, (
+        "id", "order", "transaction_id", "created", "created_by",
+        "serial_no", "pin", "product_id", "name", "price",
+    )),
+    "orders": (Order, _order_rows, (
+        "id", "transaction_id", "created", "created_by",
+        "product_id", "name", "price", "quantity", "total_price",
+    )),
+}
+
+
+class _Echo:
+    """File-like object whose write() hands the written string back."""
+
+    def write(self, value):
+        return value
+
+
+def export_queryset(kind):
+    """Unfiltered, stably ordered queryset for an export kind."""
+    model, _, _ = EXPORTS[kind]
+    return model.objects.order_by("created", "id")
+
+
+def stream_export(kind, file_format, queryset):
+    """Yield ``queryset`` as CSV or NDJSON text, one row at a time.
+
+    Rows are read with a chunked server-side iterator over flat
+    ``values_list`` tuples, so memory stays constant whatever the size.
+    """
+    _, rows, columns = EXPORTS[kind]
+    if file_format == "csv":
+        writer = csv.DictWriter(_Echo(), fieldnames=columns)
+        yield writer.writeheader()
+        for row in rows(queryset):
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows(queryset):
+            yield encoder.encode(row) + "\n"
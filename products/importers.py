@@ -0,0 +1,157 @@
+import csv
+import json
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, ProductKeys
+
+CHUNK_SIZE = 5000
+# Rejected rows listed in a result; the count covers all of them.
+MAX_REPORTED_REJECTS = 1000
+PIN_MAX_LENGTH = ProductKeys._meta.get_field("pin").max_length
+SERIAL_MAX_LENGTH = ProductKeys._meta.get_field("serial_no_value").max_length
+
+FORMATS = ("csv", "ndjson")
+
+
+class ImportFormatError(Exception):
+    """The upload as a whole can't be read, e.g. a CSV without a pin column."""
+
+
+def detect_format(name, requested=None):
+    """The import format asked for, or the one the file name suggests."""
+    if requested:
+        return requested
+    if name and name.lower().endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return "csv"
+
+
+def _csv_rows(lines):
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or "pin" not in reader.fieldnames:
+        raise ImportFormatError("The CSV header must have a pin column.")
+    # Row numbers count the header as line 1, as a spreadsheet would.
+    for number, row in enumerate(reader, start=2):
+        yield number, row.get("pin"), row.get("serial_no"), None
+
+
+def _ndjson_rows(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, None, "Invalid JSON."
+            continue
+        if not isinstance(row, dict):
+            yield number, None, None, "Expected a JSON object."
+            continue
+        yield number, row.get("pin"), row.get("serial_no"), None
+
+
+def _decoded_lines(file):
+    # Decoded a line at a time, so bad bytes are reported on their own
+    # line rather than somewhere in a buffered block.
+    for number, line in enumerate(file, start=1):
+        try:
+            yield line.decode("utf-8-sig" if number == 1 else "utf-8")
+        except UnicodeDecodeError:
+            raise ImportFormatError(f"Row {number} is not valid UTF-8.")
+
+
+def parse_rows(file, file_format):
+    """Yield ``(row number, pin, serial_no, error)`` from a binary upload, one row at a time.
+
+    Raises ``ImportFormatError`` at the first row that can't be read.
+    Rows are read lazily, so the chunks ``KeyImport`` committed before
+    that row stay imported.
+    """
+    lines = _decoded_lines(file)
+    rows = _csv_rows(lines) if file_format == "csv" else _ndjson_rows(lines)
+    for number, pin, serial_no, error in rows:
+        if error is None:
+            pin = str(pin).strip() if pin is not None else ""
+            serial_no = str(serial_no).strip() if serial_no not in (None, "") else None
+            if not pin:
+                error = "Missing pin."
+            elif len(pin) > PIN_MAX_LENGTH:
+                error = f"Pin is longer than {PIN_MAX_LENGTH} characters."
+            elif "\x00" in pin:
+                error = "Pin contains a NUL character."
+            elif serial_no and len(serial_no) > SERIAL_MAX_LENGTH:
+                error = f"Serial number is longer than {SERIAL_MAX_LENGTH} characters."
+            elif serial_no and "\x00" in serial_no:
+                error = "Serial number contains a NUL character."
+        yield number, pin, serial_no, error
+
+
+class KeyImport:
+    """Insert parsed rows as keys of one product, a chunk at a time.
+
+    A pin is rejected if it already exists on any key, looked up per chunk
+    through ``productkeys_pin_idx``, or earlier in the same upload. Each
+    chunk is one ``bulk_create`` and one stock counter update in its own
+    transaction, so a failed import keeps the chunks before it.
+    """
+
+    def __init__(self, product, user=None, chunk_size=CHUNK_SIZE):
+        self.product = product
+        self.user = user
+        self.chunk_size = chunk_size
+        self.imported = 0
+        self.rejected = 0
+        self.rejects = []
+        self.seen = set()
+
+    def run(self, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self
+
+    def reject(self, number, pin, reason):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"row": number, "pin": pin, "reason": reason})
+
+    def import_chunk(self, rows):
+        pins = [pin for _, pin, _, error in rows if error is None]
+        existing = set(ProductKeys.objects.filter(pin__in=pins).values_list("pin", flat=True))
+
+        now = timezone.now()
+        keys = []
+        for number, pin, serial_no, error in rows:
+            if error is None and pin in existing:
+                error = "Pin already exists."
+            elif error is None and pin in self.seen:
+                error = "Duplicate pin in this file."
+            if error:
+                self.reject(number, pin, error)
+                continue
+            self.seen.add(pin)
+            keys.append(ProductKeys(
+                product=self.product, pin=pin, serial_no_value=serial_no,
+                created=now, modified=now, created_by=self.user, updated_by=self.user,
+            ))
+
+        if keys:
+            with transaction.atomic():
+                ProductKeys.objects.bulk_create(keys)
+                Product.adjust_stock(self.product.pk, available=len(keys))
+            self.imported += len(keys)
+
+    def result(self):
+        return {
+            "product": self.product.pk,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "rejects": self.rejects,
+        }
@@ -0,0 +1,204 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.models import User
+from products.models import Notification, Order, Product, ProductKeys
+from products.urls import router
+
+from .seed_dataset import SEED_PREFIX
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every products endpoint against a seeded dataset and report p50/p95 "
+        "latency and query counts, optionally against a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--only", action="append", help="Run only cases whose name contains this.")
+        parser.add_argument("--baseline", help="Compare against this baseline JSON file.")
+        parser.add_argument("--save-baseline", help="Write the results to this JSON file.")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.25,
+            help="Allowed p95 slowdown against the baseline, as a fraction.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            admin = User.objects.get(username=f"{SEED_PREFIX}-admin")
+            reseller = User.objects.get(username=f"{SEED_PREFIX}-reseller-0")
+        except User.DoesNotExist:
+            raise CommandError("No seeded dataset found; run seed_dataset first.")
+
+        clients = {"admin": self.client_for(admin), "reseller": self.client_for(reseller)}
+        cases = self.cases()
+        self.warn_uncovered(cases)
+        if options["only"]:
+            cases = [case for case in cases if any(part in case[0] for part in options["only"])]
+
+        results = {}
+        for name, role, method, path, data in cases:
+            results[name] = self.measure(
+                clients[role], method, path, data, options["iterations"], options["warmup"])
+            self.report(name, results[name])
+
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as baseline:
+                json.dump(results, baseline, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline written to {options['save_baseline']}.")
+
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+        return client
+
+    def cases(self):
+        """(name, role, method, path, data) for every route in products/urls.py.
+
+        ``data`` may be a callable taking the iteration number, for writes
+        that need a fresh transaction id each time.
+        """
+        product = Product.objects.filter(available_keys__gt=10).order_by("id").first()
+        if product is None:
+            raise CommandError("The seeded dataset has no product with free keys left.")
+        other = Product.objects.exclude(pk=product.pk).order_by("id").first() or product
+        key = ProductKeys.objects.filter(product=product).order_by("id").first()
+        order = Order.objects.order_by("-created").first()
+        # transaction/verify only finds the asking client's own orders.
+        own_order = Order.objects.filter(
+            created_by__username=f"{SEED_PREFIX}-reseller-0").order_by("-created").first() or order
+        notification = Notification.objects.filter(is_read=False).order_by("id").first()
+        today = timezone.now().date()
+        week_ago = str(today - timedelta(days=7))
+
+        return [
+            ("api root", "reseller", "get", "/", None),
+            ("products list", "reseller", "get", "/products/", None),
+            ("products detail", "reseller", "get", f"/products/{product.id}/", None),
+            ("admin products list", "admin", "get", "/admin-products/", None),
+            ("admin products detail", "admin", "get", f"/admin-products/{product.id}/", None),
+            ("admin product keys", "admin", "get", f"/admin-products/{product.id}/keys/", None),
+            ("admin keys list", "admin", "get", "/admin-products-keys/", None),
+            ("admin keys detail", "admin", "get", f"/admin-products-keys/{key.id}/", None),
+            ("orders list", "admin", "get", "/order/", None),
+            ("orders detail", "admin", "get", f"/order/{order.id}/", None),
+            ("orders export", "admin", "get", f"/order/export/?created_after={week_ago}", None),
+            ("orders reseller sales", "admin", "get", "/order/reseller_sales/", None),
+            ("orders revenu", "admin", "get", "/order/revenu/", None),
+            ("orders revenu cursor", "admin", "get", "/order/revenu/?pagination=cursor", None),
+            ("orders summary", "admin", "get", "/order/summary/", None),
+            ("orders sold per day", "admin", "get",
+             f"/order/total_sold_per_product_per_day/?start_date={week_ago}&end_date={today}", None),
+            ("notifications list", "admin", "get", "/notifications/", None),
+            ("notifications detail", "admin", "get", f"/notifications/{notification.id}/", None),
+            ("notifications mark as read", "admin", "patch",
+             f"/notifications/{notification.id}/mark_as_read/", {}),
+            ("purchase", "reseller", "post", "/product/purchase/", lambda i: {
+                "product_id": product.id, "quantity": 1, "transaction_id": f"bench-{time.time_ns()}-{i}",
+            }),
+            ("purchase basket", "reseller", "post", "/product/purchase/basket/", lambda i: {
+                "transaction_id": f"bench-{time.time_ns()}-{i}",
+                "lines": [{"product_id": product.id, "quantity": 2}],
+            }),
+            ("admin keys bulk delete", "admin", "post",
+             f"/admin-products-keys/bulk_delete/?product={product.id}", {}),
+            ("admin keys bulk restore", "admin", "post",
+             f"/admin-products-keys/bulk_restore/?product={product.id}", {}),
+            ("admin keys bulk reassign", "admin", "post",
+             f"/admin-products-keys/bulk_reassign/?product={product.id}", {"product": other.id}),
+            ("admin import keys", "admin", "post", f"/admin-products/{product.id}/import_keys/",
+             lambda i: {"file": SimpleUploadedFile("keys.csv", "\n".join(
+                 ["pin"] + [f"bench-{time.time_ns()}-{i}-{n}" for n in range(1000)]).encode())}),
+            ("transaction verify", "reseller", "post", "/transaction/verify/", {
+                "transaction_id": own_order.transaction_id,
+            }),
+        ]
+
+    def warn_uncovered(self, cases):
+        covered = {path.split("?")[0] for _, _, _, path, _ in cases}
+        for url in router.urls:
+            if "format" in url.pattern.regex.groupindex:
+                continue
+            if not any(url.pattern.regex.match(path.lstrip("/")) for path in covered):
+                self.stderr.write(self.style.WARNING(f"No benchmark case for {url.pattern}"))
+
+    def measure(self, client, method, path, data, iterations, warmup):
+        """Time ``iterations`` requests; writes are rolled back to keep the dataset fixed.
+
+        Rolled back writes never run their on-commit work (low stock checks,
+        cache invalidation), so that is not part of the numbers.
+        """
+        latencies = []
+        queries = []
+        for i in range(warmup + iterations):
+            payload = data(i) if callable(data) else data
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    if method == "get":
+                        response = client.get(path)
+                    else:
+                        uploads = isinstance(payload, dict) and any(
+                            hasattr(value, "read") for value in payload.values())
+                        response = getattr(client, method)(
+                            path, payload, format="multipart" if uploads else "json")
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                    elapsed = time.perf_counter() - start
+                if method != "get":
+                    transaction.set_rollback(True)
+            if response.status_code >= 400:
+                raise CommandError(f"{method.upper()} {path} answered {response.status_code}.")
+            if i >= warmup:
+                latencies.append(elapsed * 1000)
+                queries.append(len(captured))
+
+        return {
+            "p50_ms": round(percentile(latencies, 0.5), 2),
+            "p95_ms": round(percentile(latencies, 0.95), 2),
+            "queries": max(queries),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<30} p50 {result['p50_ms']:>9.2f} ms  "
+            f"p95 {result['p95_ms']:>9.2f} ms  queries {result['queries']:>4}"
+        )
+
+    def compare(self, results, path, tolerance):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result["queries"] > before["queries"]:
+                regressions.append(f"{name}: {before['queries']} -> {result['queries']} queries")
+            if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
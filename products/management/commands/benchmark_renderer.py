@@ -0,0 +1,98 @@
+import json
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+
+class LegacyJSONRenderer(JSONRenderer):
+    """The envelope renderer as it was before the fast path, for comparison."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        response = {
+            "status": True,
+            "message": "Success",
+            **data
+        }
+
+        if isinstance(data, dict) and "error" in data:
+            response["status"] = False
+            response["message"] = data.get("error", "Error")
+
+        return super().render(response, accepted_media_type, renderer_context)
+
+
+def order_page(orders, cards):
+    """A paginated order listing shaped like OrderSerializer output."""
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    results = []
+    for order_id in range(1, orders + 1):
+        results.append({
+            "id": order_id,
+            "transaction_id": f"TX-{order_id:08d}",
+            "product_id": order_id % 20 + 1,
+            "quantity": cards,
+            "Cards": [
+                {
+                    "id": order_id * cards + card,
+                    "trxId": f"TX-{order_id:08d}",
+                    "serial_no": f"SN-{order_id * cards + card:06d}-{order_id % 20 + 1:04d}",
+                    "pin": f"{order_id:06d}{card:06d}",
+                    "name": "Gift card",
+                    "description": "Prepaid gift card redeemable online.",
+                    "price": Decimal("10.00"),
+                    "order": order_id,
+                    "created": now,
+                    "created_by": 1,
+                    "modified": now,
+                    "updated_by": 1,
+                }
+                for card in range(cards)
+            ],
+            "product_name": "Gift card",
+            "price": Decimal("10.00"),
+            "total_price": Decimal("10.00") * cards,
+            "product_description": "Prepaid gift card redeemable online.",
+            "product_image": "/media/products/gift-card.png",
+            "created": now,
+            "created_by": 1,
+            "modified": now,
+            "updated_by": 1,
+        })
+    return {"count": orders, "next": None, "previous": None, "results": results}
+
+
+class Command(BaseCommand):
+    help = "Compare the legacy envelope renderer with the configured one on a synthetic order page."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=100, help="Orders on the page.")
+        parser.add_argument("--cards", type=int, default=5, help="Cards per order.")
+        parser.add_argument("--repeat", type=int, default=50, help="Renders per measurement.")
+
+    def handle(self, *args, **options):
+        data = order_page(options["orders"], options["cards"])
+        repeat = options["repeat"]
+
+        legacy = LegacyJSONRenderer()
+        current = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+        if json.loads(legacy.render(data)) != json.loads(current.render(data)):
+            self.stderr.write(self.style.WARNING("Renderers disagree on the output."))
+
+        timings = {}
+        for label, renderer in (("legacy", legacy), ("current", current)):
+            best = min(timeit.repeat(lambda: renderer.render(data), number=repeat, repeat=5))
+            timings[label] = best / repeat
+            self.stdout.write(f"{label:>8}: {timings[label] * 1000:.3f} ms per page")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Speedup: {timings['legacy'] / timings['current']:.1f}x "
+            f"({options['orders']} orders x {options['cards']} cards, "
+            f"{len(current.render(data))} bytes)"
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from products.exports import EXPORTS, FORMATS, export_queryset, filter_order_lines, stream_export
+
+# Command options by the query parameter they stand for.
+OPTIONS = {"created_after": "--start", "created_before": "--end", "username": "--username"}
+
+
+class Command(BaseCommand):
+    help = "Stream order lines or orders for a date range as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kind", choices=list(EXPORTS), default="lines")
+        parser.add_argument("--format", choices=list(FORMATS), default="csv", dest="file_format")
+        parser.add_argument("--start", help="First day to export (YYYY-MM-DD).")
+        parser.add_argument("--end", help="Day the export stops at (YYYY-MM-DD), like revenu's created_before.")
+        parser.add_argument("--username", help="Only rows created by users whose name contains this.")
+        parser.add_argument("--output", help="File to write to; defaults to stdout.")
+
+    def handle(self, *args, **options):
+        kind = options["kind"]
+        params = {param: options[option[2:]] for param, option in OPTIONS.items()}
+        try:
+            queryset = filter_order_lines(export_queryset(kind), params)
+        except ValidationError as exc:
+            (param, message), = exc.detail.items()
+            raise CommandError(f"{OPTIONS[param]}: {message}")
+
+        chunks = stream_export(kind, options["file_format"], queryset)
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
@@ -0,0 +1,152 @@
+import csv
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from authentication.models import User
+from products.importers import (
+    CHUNK_SIZE, FORMATS, MAX_REPORTED_REJECTS, ImportFormatError, KeyImport, detect_format,
+    parse_rows,
+)
+from products.models import Product, ProductKeys
+
+
+class CopyStream:
+    """File-like CSV over parsed rows, fed to COPY without building it in memory."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            lines = io.StringIO()
+            writer = csv.writer(lines)
+            for number, pin, serial_no in self._take(1000):
+                writer.writerow((number, pin, serial_no))
+            if not lines.tell():
+                break
+            self.buffer += lines.getvalue().encode()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def _take(self, count):
+        for _ in range(count):
+            row = next(self.rows, None)
+            if row is None:
+                return
+            yield row
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a CSV or NDJSON file of pins into a product without going through the API. "
+        "Uses COPY on PostgreSQL and chunked bulk_create elsewhere."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("product", type=int, help="Product id.")
+        parser.add_argument("path", help="CSV (pin, serial_no columns) or NDJSON file.")
+        parser.add_argument("--format", dest="file_format", choices=FORMATS,
+                            help="Defaults to ndjson for .ndjson/.jsonl files, csv otherwise.")
+        parser.add_argument("--username", help="Stamp the keys as created by this user.")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--show-rejects", type=int, default=20,
+                            help="Print at most this many rejected rows.")
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(pk=options["product"])
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product']} does not exist.")
+        user = None
+        if options["username"]:
+            user = User.objects.filter(username=options["username"]).first()
+            if user is None:
+                raise CommandError(f"User {options['username']!r} does not exist.")
+
+        file_format = detect_format(options["path"], options["file_format"])
+        started = time.perf_counter()
+        try:
+            with open(options["path"], "rb") as file:
+                rows = parse_rows(file, file_format)
+                if connection.vendor == "postgresql":
+                    result = self.copy(product, user, rows)
+                else:
+                    result = KeyImport(product, user, options["chunk_size"]).run(rows).result()
+        except (OSError, ImportFormatError) as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+
+        Product.recount_stock([product.pk])
+
+        for reject in result["rejects"][:options["show_rejects"]]:
+            self.stderr.write(f"Row {reject['row']}: {reject['reason']} ({reject['pin']!r})")
+        read = result["imported"] + result["rejected"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {result['imported']} key(s) into product {product.pk}, "
+            f"rejected {result['rejected']}, in {elapsed:.1f}s "
+            f"({read / elapsed if elapsed else read:.0f} rows/s)."
+        ))
+
+    def copy(self, product, user, rows):
+        """COPY valid rows into a temporary staging table, then merge the new pins.
+
+        The merge keeps the first row of each pin and skips pins any key
+        already has, in one INSERT ... SELECT inside the same transaction.
+        """
+        rejects = []
+        rejected = 0
+
+        def valid_rows():
+            nonlocal rejected
+            for number, pin, serial_no, error in rows:
+                if error:
+                    rejected += 1
+                    if len(rejects) < MAX_REPORTED_REJECTS:
+                        rejects.append({"row": number, "pin": pin, "reason": error})
+                    continue
+                yield number, pin, serial_no
+
+        keys = connection.ops.quote_name(ProductKeys._meta.db_table)
+        # Real column names: the user stamps use db_column, not the *_id default.
+        columns = ", ".join(
+            connection.ops.quote_name(ProductKeys._meta.get_field(name).column)
+            for name in ("pin", "serial_no_value", "is_used", "is_deleted", "product",
+                         "created", "modified", "created_by", "updated_by")
+        )
+        now = timezone.now()
+        user_id = user.pk if user else None
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE load_keys_staging "
+                "(line bigint, pin varchar(255), serial_no varchar(255)) ON COMMIT DROP"
+            )
+            cursor.copy_expert(
+                "COPY load_keys_staging (line, pin, serial_no) FROM STDIN WITH (FORMAT csv)",
+                CopyStream(valid_rows()),
+            )
+            cursor.execute("SELECT count(*) FROM load_keys_staging")
+            staged = cursor.fetchone()[0]
+            cursor.execute(
+                f"INSERT INTO {keys} ({columns}) "
+                "SELECT DISTINCT ON (s.pin) s.pin, NULLIF(s.serial_no, ''), false, false, %s, "
+                "%s, %s, %s, %s "
+                "FROM load_keys_staging s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {keys} k WHERE k.pin = s.pin) "
+                "ORDER BY s.pin, s.line",
+                [product.pk, now, now, user_id, user_id],
+            )
+            imported = cursor.rowcount
+
+        return {
+            "product": product.pk,
+            "imported": imported,
+            "rejected": rejected + staged - imported,
+            "rejects": rejects,
+        }
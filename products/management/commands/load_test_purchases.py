@@ -0,0 +1,153 @@
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F
+
+from authentication.models import User
+from products.models import Order, OrderLines, Product, ProductKeys
+
+from .benchmark_endpoints import percentile
+
+LOAD_TEST_PREFIX = "loadtest"
+LOAD_TEST_PASSWORD = "loadtest-password"
+
+
+def purchase_worker(base_url, credentials, product_id, purchases, quantity):
+    """Log in through auth/token, then buy ``purchases`` times; runs in a thread or process."""
+    session = requests.Session()
+    response = session.post(urljoin(base_url, "auth/token"), json=credentials, timeout=60)
+    response.raise_for_status()
+    session.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+    results = []
+    started = time.time()
+    for _ in range(purchases):
+        start = time.perf_counter()
+        response = session.post(urljoin(base_url, "product/purchase/"), json={
+            "product_id": product_id,
+            "quantity": quantity,
+            "transaction_id": f"{LOAD_TEST_PREFIX}-{uuid.uuid4().hex}",
+        }, timeout=60)
+        results.append((time.perf_counter() - start, response.status_code))
+    return {"started": started, "finished": time.time(), "results": results}
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer product/purchase/ from concurrent workers against a running server "
+        "that shares this database, then check no key was sold twice."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/")
+        parser.add_argument("--workers", type=int, default=20)
+        parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+        parser.add_argument("--purchases", type=int, default=20, help="Purchases per worker.")
+        parser.add_argument("--quantity", type=int, default=1, help="Keys per purchase.")
+        parser.add_argument("--product", type=int, help="Buy this product; by default a new one is created.")
+        parser.add_argument(
+            "--keys", type=int, default=None,
+            help="Keys for the created product; defaults to exactly what the workers will buy.",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        purchases = options["purchases"]
+        quantity = options["quantity"]
+
+        product = self.get_product(options["product"], options["keys"] or workers * purchases * quantity)
+        credentials = self.get_resellers(workers)
+        self.stdout.write(
+            f"{workers} {options['mode']} worker(s) x {purchases} purchase(s) of "
+            f"{quantity} key(s) of product {product.id} ({product.qty} free keys)."
+        )
+
+        executor = ProcessPoolExecutor if options["mode"] == "process" else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    purchase_worker, options["base_url"], reseller, product.id, purchases, quantity)
+                for reseller in credentials
+            ]
+            runs = [future.result() for future in futures]
+
+        self.report(runs, quantity)
+        self.verify(product)
+
+    def get_product(self, product_id, keys):
+        if product_id:
+            try:
+                return Product.objects.get(pk=product_id)
+            except Product.DoesNotExist:
+                raise CommandError(f"Product {product_id} does not exist.")
+
+        product = Product.objects.create(
+            name=f"Load test {uuid.uuid4().hex[:8]}", price=1, image="products/loadtest.png")
+        ProductKeys.objects.bulk_create(
+            ProductKeys(product=product, pin=f"{LOAD_TEST_PREFIX}-{product.id}-{i}")
+            for i in range(keys)
+        )
+        Product.recount_stock([product.id])
+        product.refresh_from_db()
+        return product
+
+    def get_resellers(self, count):
+        credentials = []
+        for i in range(count):
+            username = f"{LOAD_TEST_PREFIX}-reseller-{i}"
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                user = User.objects.create_user(username=username, password=LOAD_TEST_PASSWORD)
+            credentials.append({
+                "username": username,
+                "password": LOAD_TEST_PASSWORD,
+                "client_id": str(user.client_id),
+                "client_secret": str(user.client_secret),
+            })
+        return credentials
+
+    def report(self, runs, quantity):
+        results = [result for run in runs for result in run["results"]]
+        elapsed = max(run["finished"] for run in runs) - min(run["started"] for run in runs)
+        latencies = [seconds * 1000 for seconds, _ in results]
+        created = sum(1 for _, status in results if status == 201)
+        rejected = sum(1 for _, status in results if 400 <= status < 500)
+        failed = len(results) - created - rejected
+
+        self.stdout.write(
+            f"{created} order(s), {rejected} rejected, {failed} failed in {elapsed:.2f}s: "
+            f"{created / elapsed:.1f} orders/s, {created * quantity / elapsed:.1f} keys/s"
+        )
+        self.stdout.write(
+            f"latency p50 {percentile(latencies, 0.5):.1f} ms, "
+            f"p95 {percentile(latencies, 0.95):.1f} ms, "
+            f"p99 {percentile(latencies, 0.99):.1f} ms, max {max(latencies):.1f} ms"
+        )
+        if failed:
+            self.stderr.write(self.style.WARNING(f"{failed} purchase(s) failed with a 5xx."))
+
+    def verify(self, product):
+        """No key may be on two order lines; every order must have one line per unit."""
+        lines = OrderLines.objects.filter(product_key__product=product)
+        shared_keys = lines.values("product_key").annotate(lines=Count("id")).filter(lines__gt=1)
+        short_orders = Order.objects.filter(product_id=product).annotate(
+            lines=Count("Cards")).exclude(quantity=F("lines"))
+        orphaned = ProductKeys.objects.filter(
+            product=product, is_used=True, order_line_keys__isnull=True)
+
+        problems = []
+        if shared_keys:
+            problems.append(f"{len(shared_keys)} key(s) are on more than one order line")
+        if short_orders:
+            problems.append(f"{len(short_orders)} order(s) have a line count different from quantity")
+        if orphaned.exists():
+            problems.append(f"{orphaned.count()} used key(s) have no order line")
+        if problems:
+            raise CommandError("Allocation is inconsistent: " + "; ".join(problems) + ".")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"No key was allocated twice across {lines.count()} order line(s)."))
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import DailySales
+
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}. Use YYYY-MM-DD.")
+
+
+class Command(BaseCommand):
+    help = "Backfill or rebuild the per product, per day sales rollup from orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=parse_day, help="First day to rebuild (YYYY-MM-DD).")
+        parser.add_argument("--end", type=parse_day, help="Last day to rebuild (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        rows = DailySales.rebuild(options["start"], options["end"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} daily sales row(s)."))
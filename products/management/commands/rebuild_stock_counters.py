@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Rebuild or verify the denormalized per-product key counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report products whose counters drifted; exit non-zero if any did.",
+        )
+        parser.add_argument(
+            "--product",
+            type=int,
+            action="append",
+            dest="products",
+            help="Limit to this product id (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        products = options["products"]
+        queryset = Product.counted_stock()
+        if products:
+            queryset = queryset.filter(pk__in=products)
+
+        drifted = queryset.exclude(
+            Q(available_keys=F("counted_available")) & Q(used_keys=F("counted_used"))
+        ).values_list("id", "available_keys", "counted_available", "used_keys", "counted_used")
+
+        for product_id, available, counted_available, used, counted_used in drifted:
+            self.stdout.write(
+                f"Product {product_id}: available {available} -> {counted_available}, "
+                f"used {used} -> {counted_used}"
+            )
+
+        if options["check"]:
+            if drifted:
+                raise CommandError(f"{len(drifted)} product(s) have drifted stock counters.")
+            self.stdout.write(self.style.SUCCESS("Stock counters are consistent."))
+            return
+
+        updated = Product.recount_stock(products)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stock counters for {updated} product(s)."))
@@ -0,0 +1,168 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from authentication.models import User
+from products.models import DailySales, Notification, Order, OrderLines, Product, ProductKeys
+
+SEED_PREFIX = "seed"
+SEED_PASSWORD = "seed-password"
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic, production-sized dataset of products, keys, "
+        "orders, order lines, notifications and resellers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50)
+        parser.add_argument("--keys", type=int, default=20_000, help="Keys per product.")
+        parser.add_argument("--resellers", type=int, default=20)
+        parser.add_argument("--orders", type=int, default=50_000)
+        parser.add_argument("--max-quantity", type=int, default=5, help="Largest order quantity.")
+        parser.add_argument("--notifications", type=int, default=200)
+        parser.add_argument("--days", type=int, default=90, help="Spread orders over this many days.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username=f"{SEED_PREFIX}-admin").exists():
+            raise CommandError("The database is already seeded.")
+
+        self.rng = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
+        # Whole days, so the same seed yields the same rows on the same day.
+        self.anchor = datetime.combine(timezone.now().date(), datetime.min.time())
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            admin, resellers = self.create_users(options["resellers"])
+            products = self.create_products(admin, options["products"])
+            orders = self.create_orders(
+                products, resellers, options["orders"], options["keys"],
+                options["max_quantity"], options["days"])
+            keys = self.create_keys(admin, products, orders, options["keys"], options["days"])
+            self.create_notifications(admin, products, options["notifications"])
+
+            Product.recount_stock([product.id for product in products])
+            DailySales.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(products)} products, {keys} keys, {len(orders)} orders and "
+            f"{len(resellers)} resellers in {time.perf_counter() - started:.1f}s. "
+            f"Users {SEED_PREFIX}-admin and {SEED_PREFIX}-reseller-N use password {SEED_PASSWORD!r}."
+        ))
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        admin = User.objects.create(
+            username=f"{SEED_PREFIX}-admin", password=password, is_staff=True, is_superuser=True)
+        resellers = User.objects.bulk_create(
+            User(username=f"{SEED_PREFIX}-reseller-{i}", password=password, created_by=admin)
+            for i in range(count)
+        )
+        return admin, resellers
+
+    def create_products(self, admin, count):
+        return Product.objects.bulk_create(
+            Product(
+                name=f"Seed product {i}",
+                description=f"Seeded product number {i}.",
+                price=self.rng.choice((500, 1000, 2500, 5000, 10000)),
+                image="products/seed.png",
+                stock_warning_threshold=self.rng.randint(5, 50),
+                created_by=admin,
+                updated_by=admin,
+            )
+            for i in range(count)
+        )
+
+    def create_orders(self, products, resellers, count, keys_per_product, max_quantity, days):
+        """Orders oldest first; no product sells more than 80% of its keys."""
+        budget = {product.id: int(keys_per_product * 0.8) for product in products}
+        orders = []
+        for _ in range(count):
+            product = self.rng.choice(products)
+            quantity = min(self.rng.randint(1, max_quantity), budget[product.id])
+            if not quantity:
+                continue
+            budget[product.id] -= quantity
+            reseller = self.rng.choice(resellers)
+            created = self.anchor - timedelta(seconds=self.rng.randrange(days * 24 * 60 * 60))
+            orders.append(Order(
+                product_id=product, quantity=quantity, unit_price=product.price,
+                transaction_id=f"{SEED_PREFIX}-{self.rng.getrandbits(64):016x}",
+                created=created, created_by=reseller, updated_by=reseller,
+            ))
+        orders.sort(key=lambda order: order.created)
+
+        for chunk in chunked(orders, self.chunk_size):
+            Order.objects.bulk_create(chunk)
+        return orders
+
+    def create_keys(self, admin, products, orders, keys_per_product, days):
+        """Keys per product, the first ones used by that product's orders in order."""
+        by_product = {product.id: [] for product in products}
+        for order in orders:
+            by_product[order.product_id_id].extend([order] * order.quantity)
+
+        loaded = self.anchor - timedelta(days=days + 1)
+        created = 0
+        for product in products:
+            used_by = by_product[product.id]
+            keys = (
+                ProductKeys(
+                    product=product,
+                    pin=f"{self.rng.getrandbits(64):016x}",
+                    serial_no_value=f"SEED-{product.id:04d}-{i:08d}",
+                    is_used=i < len(used_by),
+                    used_order=used_by[i] if i < len(used_by) else None,
+                    used_at=used_by[i].created if i < len(used_by) else None,
+                    created=loaded,
+                    created_by=admin,
+                    updated_by=admin,
+                )
+                for i in range(keys_per_product)
+            )
+            for chunk in chunked(keys, self.chunk_size):
+                ProductKeys.objects.bulk_create(chunk)
+                OrderLines.objects.bulk_create(
+                    OrderLines(
+                        order=key.used_order, product_key=key, created=key.used_at,
+                        created_by=key.used_order.created_by,
+                        updated_by=key.used_order.created_by,
+                    )
+                    for key in chunk if key.is_used
+                )
+                created += len(chunk)
+        return created
+
+    def create_notifications(self, admin, products, count):
+        Notification.objects.bulk_create(
+            Notification(
+                title="Low Stock Warning",
+                message=f"Seeded notification {i}.",
+                is_read=self.rng.random() < 0.5,
+                product=self.rng.choice(products),
+                created_by=admin,
+                updated_by=admin,
+            )
+            for i in range(count)
+        )
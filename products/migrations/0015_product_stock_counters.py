@@ -0,0 +1,50 @@
+# Generated by Django 4.1 on 2026-10-18 17:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_keys(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    ProductKeys = apps.get_model("products", "ProductKeys")
+
+    def count(is_used):
+        keys = (
+            ProductKeys.objects.filter(
+                product=OuterRef("pk"), is_used=is_used, is_deleted=False
+            )
+            .order_by()
+            .values("product")
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        return Coalesce(Subquery(keys), Value(0))
+
+    Product.objects.update(available_keys=count(False), used_keys=count(True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0014_product_stock_warning_threshold_notification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="available_keys",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="used_keys",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="product",
+            name="stock_warning_threshold",
+            field=models.PositiveIntegerField(default=5),
+        ),
+        migrations.RunPython(count_keys, migrations.RunPython.noop),
+    ]
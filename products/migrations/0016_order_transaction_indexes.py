@@ -0,0 +1,23 @@
+# Generated by Django 4.1 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0015_product_stock_counters"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["created_by", "transaction_id"], name="order_client_trx_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["transaction_id"], name="order_trx_idx"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0016_order_transaction_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="low_stock_alerted",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0017_product_low_stock_alerted"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["created"], name="order_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="orderlines",
+            index=models.Index(fields=["created"], name="orderlines_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="productkeys",
+            index=models.Index(
+                fields=["product", "is_used", "is_deleted"],
+                name="productkeys_stock_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productkeys",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False), ("is_used", False)),
+                fields=["product", "id"],
+                name="productkeys_free_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productkeys",
+            index=models.Index(
+                fields=["-used_at", "-created"], name="productkeys_ordering_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.1 on 2026-10-18 17:27
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill(apps, schema_editor):
+    Order = apps.get_model("products", "Order")
+    DailySales = apps.get_model("products", "DailySales")
+
+    totals = (
+        Order.objects.filter(product_id__isnull=False)
+        .annotate(date=TruncDate("created"))
+        .values("product_id", "date")
+        .annotate(
+            total_sold=Sum("quantity"),
+            total_price=Sum(F("quantity") * F("product_id__price")),
+        )
+        .order_by()
+    )
+    DailySales.objects.bulk_create(
+        (
+            DailySales(
+                product_id=row["product_id"], date=row["date"],
+                quantity=row["total_sold"], revenue=row["total_price"],
+            )
+            for row in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0018_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailySales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("quantity", models.PositiveIntegerField(default=0)),
+                ("revenue", models.PositiveBigIntegerField(default=0)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_sales",
+                        to="products.product",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="dailysales",
+            index=models.Index(fields=["date", "product"], name="dailysales_date_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="dailysales",
+            constraint=models.UniqueConstraint(
+                fields=("product", "date"), name="dailysales_product_date_uniq"
+            ),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
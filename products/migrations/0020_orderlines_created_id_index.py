@@ -0,0 +1,23 @@
+# Generated by Django 4.1 on 2026-10-18 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0019_daily_sales"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="orderlines",
+            name="orderlines_created_idx",
+        ),
+        migrations.AddIndex(
+            model_name="orderlines",
+            index=models.Index(
+                fields=["created", "id"], name="orderlines_created_id_idx"
+            ),
+        ),
+    ]
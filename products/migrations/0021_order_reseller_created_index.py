@@ -0,0 +1,19 @@
+# Generated by Django 4.1 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0020_orderlines_created_id_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["created_by", "created"], name="order_reseller_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0021_order_reseller_created_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="productkeys",
+            index=models.Index(fields=["pin"], name="productkeys_pin_idx"),
+        ),
+    ]
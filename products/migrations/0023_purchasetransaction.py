@@ -0,0 +1,102 @@
+# Generated by Django 4.1 on 2026-10-18 17:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+def backfill(apps, schema_editor):
+    Order = apps.get_model("products", "Order")
+    PurchaseTransaction = apps.get_model("products", "PurchaseTransaction")
+
+    purchases = (
+        Order.objects.filter(created_by__isnull=False)
+        .values_list("created_by", "transaction_id")
+        .distinct()
+        .order_by()
+    )
+    PurchaseTransaction.objects.bulk_create(
+        (
+            PurchaseTransaction(
+                created_by_id=user_id, updated_by_id=user_id,
+                transaction_id=transaction_id,
+            )
+            for user_id, transaction_id in purchases.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("products", "0022_productkeys_pin_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PurchaseTransaction",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="created",
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="modified",
+                    ),
+                ),
+                ("transaction_id", models.CharField(max_length=255)),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        db_column="created_by",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)ss_created_by",
+                        related_query_name="%(class)s_created_by",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "updated_by",
+                    models.ForeignKey(
+                        blank=True,
+                        db_column="updated_by",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)ss_updated_by",
+                        related_query_name="%(class)s_updated_by",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="purchasetransaction",
+            constraint=models.UniqueConstraint(
+                fields=("created_by", "transaction_id"), name="purchase_client_trx_uniq"
+            ),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
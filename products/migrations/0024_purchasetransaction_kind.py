@@ -0,0 +1,22 @@
+# Generated by Django 4.1 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0023_purchasetransaction"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="purchasetransaction",
+            name="kind",
+            field=models.CharField(
+                blank=True,
+                choices=[("single", "Single product"), ("basket", "Basket")],
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1 on 2026-10-18 18:06
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill(apps, schema_editor):
+    # Past prices were never stored, so existing orders get the price
+    # their product has now; orders placed from here on keep their own.
+    Order = apps.get_model("products", "Order")
+    Product = apps.get_model("products", "Product")
+
+    Order.objects.filter(unit_price__isnull=True, product_id__isnull=False).update(
+        unit_price=Subquery(Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0024_purchasetransaction_kind"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="unit_price",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
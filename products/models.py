@@ -1,9 +1,14 @@
 import os
 import uuid
+from datetime import timedelta
 
 from model_utils import Choices
+from model_utils.tracker import FieldTracker
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.dispatch import Signal
 from imagekit.models import ProcessedImageField
 from smart_selects.db_fields import ChainedForeignKey
 from django.core.mail import EmailMessage
@@ -17,6 +22,11 @@ from model_utils.models import TimeStampedModel
 # Create your models here.
 
 
+# Sent when products may have gone in or out of stock; ``product_ids`` is
+# None when any product may have.
+stock_availability_changed = Signal()
+
+
 def get_upload_path(instance, filename):
     ext = filename.split(".")[-1]
     filename = f"{uuid.uuid4()}.{ext}"
@@ -55,21 +65,92 @@ class Product(UserStampedModel, TimeStampedModel):
                               max_length=50, default=STATUS.active)
     stock_warning_threshold = models.PositiveIntegerField(default=5)
 
+    # Denormalized key counters, kept in step with ProductKeys by
+    # ProductKeys.save, the key post_delete receiver in products.signals
+    # and the allocation service.
+    # Rebuild with `manage.py rebuild_stock_counters`.
+    available_keys = models.PositiveIntegerField(default=0, editable=False)
+    used_keys = models.PositiveIntegerField(default=0, editable=False)
+    # Set once a low stock warning went out, cleared when stock recovers.
+    low_stock_alerted = models.BooleanField(default=False, editable=False)
+
+    # Columns only ever moved by targeted UPDATEs; a plain save() of a
+    # product loaded earlier must not write stale values back.
+    SERVICE_FIELDS = ("available_keys", "used_keys", "low_stock_alerted")
+
     @property
     def product_id(self):
         return self.id
 
     @property
     def qty(self):
-        return ProductKeys.objects.filter(is_used=False, product=self.id, is_deleted=False).count()
-    
+        return self.available_keys
+
     @property
     def used_stock(self):
-        return ProductKeys.objects.filter(product=self.id, is_used=True, is_deleted=False).count()
+        return self.used_keys
 
     @property
     def stock(self):
-        return ProductKeys.objects.filter(product=self.id, is_used=False, is_deleted=False).exists()
+        return self.available_keys > 0
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.SERVICE_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def adjust_stock(cls, product_id, available=0, used=0):
+        """Shift the stock counters of one product by the given deltas.
+
+        Sends ``stock_availability_changed`` when the product goes in or
+        out of stock.
+        """
+        if not (available or used):
+            return
+        cls.objects.filter(pk=product_id).update(
+            available_keys=F("available_keys") + available,
+            used_keys=F("used_keys") + used,
+        )
+        if available:
+            left = cls.objects.filter(pk=product_id).values_list("available_keys", flat=True).first()
+            if left == (available if available > 0 else 0):
+                stock_availability_changed.send(sender=cls, product_ids=[product_id])
+
+    @classmethod
+    def counted_stock(cls):
+        """Products annotated with key counts taken straight from ProductKeys."""
+        def count(**filters):
+            keys = (
+                ProductKeys.objects.filter(product=OuterRef("pk"), is_deleted=False, **filters)
+                .order_by()
+                .values("product")
+                .annotate(total=Count("pk"))
+                .values("total")
+            )
+            return Coalesce(Subquery(keys), Value(0))
+
+        return cls.objects.annotate(
+            counted_available=count(is_used=False),
+            counted_used=count(is_used=True),
+        )
+
+    @classmethod
+    def recount_stock(cls, product_ids=None):
+        """Rewrite the stock counters from ProductKeys in one UPDATE."""
+        queryset = cls.objects.all()
+        if product_ids is not None:
+            queryset = queryset.filter(pk__in=product_ids)
+        counted = cls.counted_stock().filter(pk=OuterRef("pk"))
+        updated = queryset.update(
+            available_keys=Subquery(counted.values("counted_available")),
+            used_keys=Subquery(counted.values("counted_used")),
+        )
+        stock_availability_changed.send(sender=cls, product_ids=product_ids)
+        return updated
 
     def __str__(self):
         return self.description
@@ -99,13 +180,41 @@ class ProductKeys(UserStampedModel, TimeStampedModel):
 
     is_deleted = models.BooleanField(default=False)
 
+    tracker = FieldTracker(fields=["product", "is_used", "is_deleted"])
+
+    @staticmethod
+    def _stock_slot(product_id, is_used, is_deleted):
+        """The (product, counter) pair a key in this state is counted under."""
+        if product_id is None or is_deleted:
+            return None
+        return product_id, "used" if is_used else "available"
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            before = None
+        else:
+            before = self._stock_slot(
+                self.tracker.previous("product"),
+                self.tracker.previous("is_used"),
+                self.tracker.previous("is_deleted"),
+            )
+        after = self._stock_slot(self.product_id, self.is_used, self.is_deleted)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if before != after:
+                if before:
+                    Product.adjust_stock(before[0], **{before[1]: -1})
+                if after:
+                    Product.adjust_stock(after[0], **{after[1]: 1})
+
     @property
     def order_number(self):
         return self.used_order.id
 
     @property
     def serial_no(self):
-        return self.serial_no_value if self.serial_no_value else f'SN-{self.id:06d}-{self.product.id:04d}'
+        return self.serial_no_value if self.serial_no_value else f'SN-{self.id:06d}-{self.product_id:04d}'
 
     @property
     def fib_order_number(self):
@@ -113,10 +222,28 @@ class ProductKeys(UserStampedModel, TimeStampedModel):
 
     @property
     def product_keys_left(self):
-        return ProductKeys.objects.filter(product=self.product).filter(is_used=False).count()
+        return self.product.qty
+
+    @classmethod
+    def for_display(cls):
+        """Keys with the product and order their serializer reads."""
+        return cls.objects.select_related("product", "used_order")
 
     class Meta:
         ordering = ['-used_at', '-created']
+        indexes = [
+            # Stock counts and per-product key listings.
+            models.Index(fields=["product", "is_used", "is_deleted"], name="productkeys_stock_idx"),
+            # Free keys per product, in the order allocation claims them.
+            models.Index(
+                fields=["product", "id"], name="productkeys_free_idx",
+                condition=Q(is_used=False, is_deleted=False),
+            ),
+            # Default listing order.
+            models.Index(fields=["-used_at", "-created"], name="productkeys_ordering_idx"),
+            # Duplicate pin checks on import.
+            models.Index(fields=["pin"], name="productkeys_pin_idx"),
+        ]
 
     def __str__(self):
         return self.pin
@@ -146,6 +273,21 @@ class Order(UserStampedModel, TimeStampedModel):
     )
     quantity = models.PositiveIntegerField()
     transaction_id = models.CharField(max_length=255)
+    # The product price when the order was placed; sales rollups sum this
+    # so later price changes don't rewrite past revenue.
+    unit_price = models.PositiveIntegerField(blank=True, null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None and self.product_id_id is not None:
+            self.unit_price = self.product_id.price
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def for_display(cls):
+        """Orders with their product and cards loaded for serialization."""
+        return cls.objects.select_related("product_id").prefetch_related(
+            Prefetch("Cards", queryset=OrderLines.for_display())
+        )
 
     @property
     def price(self):
@@ -167,10 +309,48 @@ class Order(UserStampedModel, TimeStampedModel):
     def product_image(self):
         return self.product_id.image.url
 
+    class Meta:
+        indexes = [
+            # Idempotent purchase replay and transaction verification.
+            models.Index(fields=["created_by", "transaction_id"], name="order_client_trx_idx"),
+            models.Index(fields=["transaction_id"], name="order_trx_idx"),
+            models.Index(fields=["created"], name="order_created_idx"),
+            # Per-reseller sales over time.
+            models.Index(fields=["created_by", "created"], name="order_reseller_created_idx"),
+        ]
+
     def __str__(self):
         return str(self.id)
 
 
+class PurchaseTransaction(UserStampedModel, TimeStampedModel):
+    """One row per (client, transaction_id) ever purchased.
+
+    The unique constraint is what makes purchases idempotent across
+    processes: a twin request that gets past the cache lock fails to
+    insert its row and replays the stored orders instead.
+    """
+
+    KIND = Choices(
+        ("single", "Single product"),
+        ("basket", "Basket"),
+    )
+
+    transaction_id = models.CharField(max_length=255)
+    # The endpoint that made the purchase; only that one may replay it.
+    # Blank for purchases made before the kind was recorded.
+    kind = models.CharField(choices=KIND, max_length=10, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["created_by", "transaction_id"], name="purchase_client_trx_uniq"),
+        ]
+
+    def __str__(self):
+        return self.transaction_id
+
+
 class OrderLines(UserStampedModel, TimeStampedModel):
     order = models.ForeignKey(
         Order, on_delete=models.CASCADE,
@@ -190,6 +370,11 @@ class OrderLines(UserStampedModel, TimeStampedModel):
         sort=True,
     )
 
+    @classmethod
+    def for_display(cls):
+        """Order lines with their key and product loaded for serialization."""
+        return cls.objects.select_related("product_key__product")
+
     @property
     def price(self):
         return self.product_key.product.price
@@ -214,5 +399,98 @@ class OrderLines(UserStampedModel, TimeStampedModel):
     def trxId(self):
         return self.id
 
+    class Meta:
+        indexes = [
+            # Date range reports and keyset pagination over (created, id).
+            models.Index(fields=["created", "id"], name="orderlines_created_id_idx"),
+        ]
+
     def __str__(self):
         return str(self.id)
+
+
+class DailySales(models.Model):
+    """Units and revenue sold per product and day, kept up to date as orders commit
+    or are deleted.
+
+    Rebuild with `manage.py rebuild_daily_sales`.
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE,
+        related_name="daily_sales"
+    )
+    date = models.DateField()
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "date"], name="dailysales_product_date_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["date", "product"], name="dailysales_date_idx"),
+        ]
+
+    @classmethod
+    def record(cls, product, date, quantity, unit_price):
+        """Add a sale of ``quantity`` units of ``product`` on ``date``."""
+        revenue = quantity * unit_price
+        updated = cls.objects.filter(product=product, date=date).update(
+            quantity=F("quantity") + quantity, revenue=F("revenue") + revenue)
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(product=product, date=date, quantity=quantity, revenue=revenue)
+        except IntegrityError:
+            # A concurrent order created the row first.
+            cls.objects.filter(product=product, date=date).update(
+                quantity=F("quantity") + quantity, revenue=F("revenue") + revenue)
+
+    @classmethod
+    def forget(cls, order):
+        """Take a deleted order back out of the rollup."""
+        if order.product_id_id is None or order.unit_price is None:
+            return
+        revenue = order.quantity * order.unit_price
+        # Orders that never allocated keys were never recorded.
+        cls.objects.filter(
+            product_id=order.product_id_id, date=order.created.date(),
+            quantity__gte=order.quantity, revenue__gte=revenue,
+        ).update(quantity=F("quantity") - order.quantity, revenue=F("revenue") - revenue)
+
+    @classmethod
+    def rebuild(cls, start=None, end=None):
+        """Recompute the rollup from orders, optionally for a date range only."""
+        rows = cls.objects.all()
+        orders = Order.objects.filter(product_id__isnull=False)
+        if start:
+            rows = rows.filter(date__gte=start)
+            orders = orders.filter(created__gte=start)
+        if end:
+            rows = rows.filter(date__lte=end)
+            orders = orders.filter(created__lt=end + timedelta(days=1))
+
+        totals = (
+            orders.annotate(date=TruncDate("created"))
+            .values("product_id", "date")
+            .annotate(
+                total_sold=Sum("quantity"),
+                total_price=Sum(F("quantity") * F("unit_price")),
+            )
+            .order_by()
+        )
+        with transaction.atomic():
+            rows.delete()
+            created = cls.objects.bulk_create(
+                (
+                    cls(
+                        product_id=row["product_id"], date=row["date"],
+                        quantity=row["total_sold"], revenue=row["total_price"],
+                    )
+                    for row in totals.iterator()
+                ),
+                batch_size=1000,
+            )
+        return len(created)
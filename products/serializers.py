@@ -2,14 +2,28 @@ from rest_framework import serializers
 from .models import Product, ProductKeys, Order, OrderLines, Notification
 from authentication.models import User
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import filters
-from django.utils import timezone
 
+from .services import allocate_keys, schedule_low_stock_check, NotEnoughKeys
+from core.timing import phase
 from core.serializer_fields import (
     Base64ImageField
 )
 
 
+def load_cards(orders):
+    """Fetch the cards of freshly created orders for rendering, in one query."""
+    prefetch_related_objects(orders, Prefetch("Cards", queryset=OrderLines.for_display()))
+
+
+def expand_keys(request):
+    """Whether the client asked for products with their keys embedded."""
+    if request is None:
+        return False
+    return "keys" in request.query_params.get("expand", "").split(",")
+
+
 class ProductSerializer(serializers.ModelSerializer):
     image = Base64ImageField(required=True)
 
@@ -32,23 +46,44 @@ class ProductKeysSerializer(serializers.ModelSerializer):
         )
 
 
+class BulkKeysSerializer(serializers.Serializer):
+    """Keys for a bulk action: an id list, the list filters in the query string, or both."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+
+
+class BulkReassignKeysSerializer(BulkKeysSerializer):
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.exclude(is_deleted=True))
+
+
 class ProductAdminSerializer(serializers.ModelSerializer):
+    """Products with a key summary; full key lists only with ``?expand=keys``.
+
+    Keys are otherwise served paginated from ``admin-products/{id}/keys/``.
+    """
+
     image = Base64ImageField(required=True)
+    keys_summary = serializers.SerializerMethodField()
     keys = ProductKeysSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
         fields = (
-            "id", "product_id", "name", "description", "price", "image", "stock", "qty","stock_warning_threshold", "status", "created", "created_by", "modified", "updated_by", "keys"
+            "id", "product_id", "name", "description", "price", "image", "stock", "qty","stock_warning_threshold", "status", "created", "created_by", "modified", "updated_by", "keys_summary", "keys"
         )
 
-    def to_representation(self, instance):
-        """Filter out keys where is_deleted=True"""
-        representation = super().to_representation(instance)
-        representation["keys"] = [
-            key for key in representation["keys"] if not key.get("is_deleted", False)
-        ]
-        return representation
+    def get_fields(self):
+        fields = super().get_fields()
+        if not expand_keys(self.context.get("request")):
+            fields.pop("keys")
+        return fields
+
+    def get_keys_summary(self, instance):
+        return {
+            "available": instance.qty,
+            "used": instance.used_stock,
+        }
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -95,23 +130,23 @@ class OrderSerializer(serializers.ModelSerializer):
             "modified"
         )
 
+    def is_valid(self, raise_exception=False):
+        with phase("validate"):
+            return super().is_valid(raise_exception=raise_exception)
+
     def validate(self, attrs):
         """Custom validation before creating an order."""
-        product_id = attrs.get(
-            "product_id").id  # Assuming product is a ForeignKey
+        product = attrs.get("product_id")
         qty = attrs.get("quantity")
         transaction_id = attrs.get("transaction_id")
 
-        if not Product.objects.filter(id=product_id).exists():
+        if product is None:
             raise serializers.ValidationError({
                 "message": "Product not found",
                 "transaction_id": f"{transaction_id}"
             })
 
-        available_keys = ProductKeys.objects.filter(
-            product=product_id, is_used=False, is_deleted=False).count()
-
-        if qty > available_keys:
+        if qty > product.qty:
             raise serializers.ValidationError({
                 "message": "Not enough keys available",
                 "transaction_id": f"{transaction_id}"
@@ -128,22 +163,88 @@ class OrderSerializer(serializers.ModelSerializer):
             order = Order.objects.create(
                 **validated_data, product_id=product_id, quantity=qty)
 
-            remaining_qty = qty
-            for key in ProductKeys.objects.filter(product=product_id, is_used=False, is_deleted=False)[:qty]:
-                OrderLines.objects.create(order=order, product_key=key)
-                key.is_used = True
-                key.used_at = timezone.now()
-                key.used_order = order
-                key.save()
-                remaining_qty -= 1
-
-            if ProductKeys.objects.filter(product=product_id, is_used=False, is_deleted=False).count() <= Product.objects.get(id=product_id.id).stock_warning_threshold:
-                product = Product.objects.get(id=product_id.id)
-                Notification.objects.create(
-                    title="Low Stock Warning",
-                    message=f"The stock for product '{product.name}' is low. Only {ProductKeys.objects.filter(product=product_id, is_used=False, is_deleted=False).count()} keys left.",
-                    product=product
-                )
-
-            order.save()
-            return order
+            try:
+                allocate_keys(order, product_id, qty)
+            except NotEnoughKeys:
+                raise serializers.ValidationError({
+                    "message": "Not enough keys available",
+                    "transaction_id": f"{transaction_id}"
+                })
+
+            schedule_low_stock_check([product_id.id])
+
+        load_cards([order])
+        return order
+
+
+class BasketLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BasketSerializer(serializers.Serializer):
+    """Buy several products at once; one order per product, one transaction."""
+
+    transaction_id = serializers.CharField(max_length=255)
+    lines = BasketLineSerializer(many=True, allow_empty=False)
+
+    def is_valid(self, raise_exception=False):
+        with phase("validate"):
+            return super().is_valid(raise_exception=raise_exception)
+
+    def validate(self, attrs):
+        transaction_id = attrs["transaction_id"]
+
+        quantities = {}
+        for line in attrs["lines"]:
+            product_id = line["product_id"]
+            quantities[product_id] = quantities.get(product_id, 0) + line["quantity"]
+
+        products = Product.objects.in_bulk(list(quantities))
+        for product_id, qty in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                raise serializers.ValidationError({
+                    "message": f"Product {product_id} not found",
+                    "transaction_id": f"{transaction_id}"
+                })
+            if qty > product.qty:
+                raise serializers.ValidationError({
+                    "message": f"Not enough keys available for product {product_id}",
+                    "transaction_id": f"{transaction_id}"
+                })
+
+        # Sorted by product so concurrent baskets lock stock rows in one order.
+        attrs["lines"] = [
+            (products[product_id], quantities[product_id])
+            for product_id in sorted(quantities)
+        ]
+        return attrs
+
+    def create(self, validated_data):
+        transaction_id = validated_data["transaction_id"]
+        orders = []
+        with transaction.atomic():
+            for product, qty in validated_data["lines"]:
+                order = Order.objects.create(
+                    transaction_id=transaction_id, product_id=product, quantity=qty)
+                try:
+                    allocate_keys(order, product, qty)
+                except NotEnoughKeys:
+                    raise serializers.ValidationError({
+                        "message": f"Not enough keys available for product {product.id}",
+                        "transaction_id": f"{transaction_id}"
+                    })
+                orders.append(order)
+
+            schedule_low_stock_check([product.id for product, _ in validated_data["lines"]])
+
+        load_cards(orders)
+        return orders
+
+    def to_representation(self, orders):
+        return {
+            "transaction_id": orders[0].transaction_id,
+            "total_price": sum(order.total_price for order in orders),
+            "orders": OrderSerializer(orders, many=True, context=self.context).data,
+        }
@@ -0,0 +1,309 @@
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from crum import get_current_user
+
+from core.timing import phase
+
+from .models import Product, ProductKeys, Order, OrderLines, Notification, DailySales, PurchaseTransaction
+
+
+class NotEnoughKeys(Exception):
+    """Raised when a product runs out of free keys while an order is being filled."""
+
+
+def free_keys(product):
+    return ProductKeys.objects.filter(
+        product=product, is_used=False, is_deleted=False)
+
+
+def _candidate_keys(product, qty, exclude):
+    """Pick up to ``qty`` free keys, skipping rows another buyer has locked."""
+    queryset = free_keys(product).exclude(id__in=exclude).order_by("id")
+    if connection.features.has_select_for_update_skip_locked:
+        queryset = queryset.select_for_update(skip_locked=True, of=("self",))
+    return list(queryset[:qty])
+
+
+def current_user():
+    """The request user as ``UserStampedModel.save`` would stamp it."""
+    user = get_current_user()
+    if user and not user.pk:
+        user = None
+    return user
+
+
+def allocate_keys(order, product, qty):
+    """Claim ``qty`` free keys of ``product`` for ``order`` and create its lines.
+
+    Must be called inside ``transaction.atomic``. On backends with
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` concurrent buyers lock disjoint
+    rows and never wait on each other. Keys are claimed with one
+    conditional UPDATE on ``is_used=False``, so on backends without row
+    locks keys taken by a concurrent buyer are simply skipped and replaced
+    with the next free ones.
+
+    Writes are set based: one UPDATE for the keys and one ``bulk_create``
+    for the order lines per round, whatever the quantity. Both bypass
+    ``UserStampedModel.save`` so ``created_by``/``updated_by`` are stamped
+    here. The product's stock counters and daily sales rollup are moved
+    last, so the row locks those UPDATEs take are held only until the
+    caller commits.
+    """
+    user = current_user()
+    now = timezone.now()
+
+    claimed = []
+    seen = []
+    while len(claimed) < qty:
+        with phase("allocate"):
+            candidates = _candidate_keys(product, qty - len(claimed), seen)
+            if not candidates:
+                raise NotEnoughKeys(product)
+
+            ids = [key.id for key in candidates]
+            seen.extend(ids)
+            won = ProductKeys.objects.filter(
+                id__in=ids, is_used=False, is_deleted=False
+            ).update(
+                is_used=True, used_at=now, used_order=order,
+                modified=now, updated_by=user,
+            )
+            if won < len(ids):
+                ids = set(ProductKeys.objects.filter(
+                    id__in=ids, used_order=order).values_list("id", flat=True))
+                candidates = [key for key in candidates if key.id in ids]
+
+        with phase("lines"):
+            OrderLines.objects.bulk_create(
+                OrderLines(
+                    order=order, product_key=key,
+                    created_by=user, updated_by=user,
+                )
+                for key in candidates
+            )
+        claimed.extend(candidates)
+
+    with phase("counters"):
+        Product.adjust_stock(product.pk, available=-qty, used=qty)
+        DailySales.record(product, order.created.date(), qty, order.unit_price)
+    return claimed
+
+
+BULK_CHUNK_SIZE = 5000
+
+# Keys each bulk operation applies to, and the change it makes to them.
+BULK_KEY_OPERATIONS = {
+    "delete": (Q(is_deleted=False), {"is_deleted": True}),
+    "restore": (Q(is_deleted=True), {"is_deleted": False}),
+    "reassign": (Q(is_deleted=False), {}),
+}
+
+
+def bulk_update_keys(queryset, operation, product=None, chunk_size=BULK_CHUNK_SIZE):
+    """Soft-delete, restore or move the unused keys of ``queryset`` to ``product``.
+
+    Keys are changed with one UPDATE per chunk of ids, each chunk in its
+    own transaction with its rows locked, and stamped like
+    ``UserStampedModel.save`` would. Stock counters move once per product
+    and chunk. Used keys are never touched. Returns the number of keys
+    changed.
+    """
+    condition, changes = BULK_KEY_OPERATIONS[operation]
+    queryset = queryset.filter(condition, is_used=False).order_by("id")
+    if operation == "reassign":
+        queryset = queryset.exclude(product=product)
+        changes = {"product": product}
+
+    user = current_user()
+    affected = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(queryset.filter(id__gt=last_id).select_for_update().values_list(
+                "id", "product_id")[:chunk_size])
+            if not rows:
+                break
+            ids = [key_id for key_id, _ in rows]
+            ProductKeys.objects.filter(id__in=ids).update(
+                **changes, modified=timezone.now(), updated_by=user)
+
+            per_product = Counter(product_id for _, product_id in rows)
+            for product_id, count in per_product.items():
+                if operation == "restore":
+                    Product.adjust_stock(product_id, available=count)
+                else:
+                    Product.adjust_stock(product_id, available=-count)
+            changed = list(per_product)
+            if operation == "reassign":
+                Product.adjust_stock(product.pk, available=len(rows))
+                changed.append(product.pk)
+            schedule_low_stock_check(changed)
+
+        affected += len(rows)
+        last_id = ids[-1]
+    return affected
+
+
+LOW_STOCK_TITLE = "Low Stock Warning"
+
+
+def schedule_low_stock_check(product_ids):
+    """Check the given products for low stock once the current transaction commits."""
+    product_ids = sorted(set(product_ids))
+
+    def check():
+        with phase("notify"):
+            check_low_stock(product_ids)
+
+    transaction.on_commit(check)
+
+
+def check_low_stock(product_ids):
+    """Raise, refresh or re-arm the low stock warning of each product.
+
+    The first time a product falls to its ``stock_warning_threshold`` one
+    notification is created; later orders only refresh the unread
+    notification's message, at most once per ``LOW_STOCK_DEBOUNCE``
+    seconds. Once stock is back above the threshold the next crossing
+    raises a new notification.
+    """
+    products = Product.objects.filter(id__in=product_ids).filter(
+        Q(available_keys__lte=F("stock_warning_threshold")) | Q(low_stock_alerted=True)
+    )
+    for product in products:
+        if product.qty > product.stock_warning_threshold:
+            Product.objects.filter(pk=product.pk).update(low_stock_alerted=False)
+            continue
+
+        message = f"The stock for product '{product.name}' is low. Only {product.qty} keys left."
+        raised = Product.objects.filter(
+            pk=product.pk, low_stock_alerted=False).update(low_stock_alerted=True)
+        if raised:
+            Notification.objects.create(
+                title=LOW_STOCK_TITLE, message=message, product=product)
+        elif cache.add(f"low-stock:{product.pk}", True, settings.LOW_STOCK_DEBOUNCE):
+            Notification.objects.filter(
+                product=product, title=LOW_STOCK_TITLE, is_read=False
+            ).update(message=message, modified=timezone.now())
+
+
+class PurchaseKindMismatch(Exception):
+    """Raised when a transaction id is reused on the other purchase endpoint."""
+
+
+def _purchase_key(user, transaction_id):
+    digest = hashlib.sha256(str(transaction_id).encode()).hexdigest()
+    return f"purchase:{user.pk}:{digest}"
+
+
+def _replay_key(user, transaction_id, kind):
+    # Single and basket responses differ in shape, so each endpoint only
+    # ever replays its own.
+    return f"{_purchase_key(user, transaction_id)}:{kind}"
+
+
+def cached_purchase(user, transaction_id, kind):
+    return cache.get(_replay_key(user, transaction_id, kind))
+
+
+def get_replayed_purchase(user, transaction_id, kind, serialize):
+    """Return the response data of an earlier purchase with this transaction id.
+
+    Purchases are idempotent per (client, transaction_id): the cached
+    response is tried first, then the stored orders. ``serialize`` turns
+    the list of orders into response data. Returns ``None`` for a new
+    transaction and raises ``PurchaseKindMismatch`` when the earlier
+    purchase went through the other endpoint.
+    """
+    data = cached_purchase(user, transaction_id, kind)
+    if data is not None:
+        return data
+
+    stored = PurchaseTransaction.objects.filter(
+        created_by=user, transaction_id=transaction_id).values_list("kind", flat=True).first()
+    if stored is None:
+        return None
+    if stored and stored != kind:
+        raise PurchaseKindMismatch(stored)
+
+    orders = list(Order.for_display().filter(
+        created_by=user, transaction_id=transaction_id).order_by("id"))
+    if not orders:
+        return None
+
+    data = serialize(orders)
+    remember_purchase(user, transaction_id, kind, data)
+    return data
+
+
+def remember_purchase(user, transaction_id, kind, data):
+    cache.set(_replay_key(user, transaction_id, kind), data, settings.PURCHASE_REPLAY_TIMEOUT)
+
+
+def begin_purchase(user, transaction_id):
+    """Mark a transaction id as in flight; False if a twin request holds it."""
+    return cache.add(
+        _purchase_key(user, transaction_id) + ":lock", True,
+        settings.PURCHASE_LOCK_TIMEOUT,
+    )
+
+
+def end_purchase(user, transaction_id):
+    cache.delete(_purchase_key(user, transaction_id) + ":lock")
+
+
+def claim_purchase(user, transaction_id, kind):
+    """Store the transaction's guard row; False if it was already purchased.
+
+    Call it in the transaction that creates the orders, so the row only
+    sticks if they do. On PostgreSQL a twin request blocks here until
+    the first one commits or rolls back.
+    """
+    try:
+        with transaction.atomic():
+            PurchaseTransaction.objects.create(
+                transaction_id=transaction_id, kind=kind,
+                created_by=user, updated_by=user)
+    except IntegrityError:
+        return False
+    return True
+
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def _seed_catalog_version():
+    # Seeded from the clock rather than 1: if the key is evicted, a fresh
+    # version must not match catalog entries or ETags cached before.
+    version = time.time_ns()
+    if not cache.add(CATALOG_VERSION_KEY, version, settings.CATALOG_VERSION_TIMEOUT):
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = _seed_catalog_version()
+    return version
+
+
+def invalidate_catalog():
+    """Retire every cached catalog response at once by bumping the version."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        _seed_catalog_version()
+
+
+def catalog_cache_key(request):
+    digest = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+    return f"catalog:{catalog_version()}:{digest}"
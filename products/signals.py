@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DailySales, Order, Product, ProductKeys, stock_availability_changed
+from .services import invalidate_catalog
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(stock_availability_changed, sender=Product)
+def product_catalog_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver(post_delete, sender=ProductKeys)
+def product_key_deleted(sender, instance, **kwargs):
+    # A receiver rather than ProductKeys.delete() so cascades from orders
+    # and queryset deletes, which never call it, keep the counters right.
+    slot = instance._stock_slot(instance.product_id, instance.is_used, instance.is_deleted)
+    if slot:
+        Product.adjust_stock(slot[0], **{slot[1]: -1})
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    DailySales.forget(instance)
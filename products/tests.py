@@ -1,3 +1,1263 @@
-from django.test import TestCase
+import csv
+import json
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+
+from crum import impersonate
+from rest_framework.settings import api_settings
+from rest_framework.test import APITestCase
+
+from authentication.models import User
+from core.metrics import registry
+from .models import Product, ProductKeys, Order, OrderLines, Notification, DailySales, PurchaseTransaction
+from .management.commands.load_test_purchases import Command as LoadTestCommand
+from .importers import ImportFormatError, KeyImport, parse_rows
+from .management.commands.load_keys import CopyStream
+from .services import CATALOG_VERSION_KEY, allocate_keys, bulk_update_keys, free_keys, get_replayed_purchase, NotEnoughKeys
+
+
+def make_product(keys=0, **kwargs):
+    kwargs.setdefault("name", "Card")
+    kwargs.setdefault("description", "Card")
+    kwargs.setdefault("price", 1000)
+    product = Product.objects.create(image="products/card.png", **kwargs)
+    ProductKeys.objects.bulk_create(
+        ProductKeys(product=product, pin=f"PIN-{product.id}-{i}") for i in range(keys)
+    )
+    Product.recount_stock([product.id])
+    product.refresh_from_db()
+    return product
+
+
+class AllocateKeysTests(TestCase):
+    def test_claims_requested_quantity(self):
+        product = make_product(keys=5)
+        order = Order.objects.create(product_id=product, quantity=3, transaction_id="t1")
+
+        with transaction.atomic():
+            keys = allocate_keys(order, product, 3)
+
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(OrderLines.objects.filter(order=order).count(), 3)
+        self.assertEqual(
+            ProductKeys.objects.filter(used_order=order, is_used=True).count(), 3)
+
+    def test_query_count_does_not_grow_with_quantity(self):
+        product = make_product(keys=60)
+        counts = []
+        for qty in (2, 40):
+            order = Order.objects.create(product_id=product, quantity=qty, transaction_id="t")
+            with CaptureQueriesContext(connection) as queries:
+                with transaction.atomic():
+                    allocate_keys(order, product, qty)
+            counts.append(len(queries))
+        # The day's first sale also inserts its DailySales row: an UPDATE
+        # that misses, then the INSERT inside a savepoint.
+        self.assertEqual(counts[0], counts[1] + 3)
+
+    def test_stamps_lines_and_keys_with_current_user(self):
+        product = make_product(keys=2)
+        user = User.objects.create(username="reseller")
+        order = Order.objects.create(product_id=product, quantity=2, transaction_id="t1")
+
+        with impersonate(user), transaction.atomic():
+            allocate_keys(order, product, 2)
+
+        for line in OrderLines.objects.filter(order=order):
+            self.assertEqual(line.created_by, user)
+            self.assertEqual(line.updated_by, user)
+        self.assertFalse(
+            ProductKeys.objects.filter(used_order=order).exclude(updated_by=user).exists())
+
+    def test_skips_deleted_keys_and_fails_when_short(self):
+        product = make_product(keys=2)
+        ProductKeys.objects.filter(product=product).update(is_deleted=True)
+        order = Order.objects.create(product_id=product, quantity=1, transaction_id="t1")
+
+        with self.assertRaises(NotEnoughKeys):
+            with transaction.atomic():
+                allocate_keys(order, product, 1)
+
+
+class StockCounterTests(TestCase):
+    def assertStock(self, product, available, used):
+        product.refresh_from_db()
+        self.assertEqual((product.qty, product.used_stock), (available, used))
+        self.assertEqual(product.stock, available > 0)
+
+    def test_key_lifecycle_moves_counters(self):
+        product = make_product()
+        key = ProductKeys.objects.create(product=product, pin="1")
+        ProductKeys.objects.create(product=product, pin="2")
+        self.assertStock(product, 2, 0)
+
+        key.is_deleted = True
+        key.save()
+        self.assertStock(product, 1, 0)
+
+        key.is_deleted = False
+        key.save()
+        self.assertStock(product, 2, 0)
+
+        other = make_product()
+        key.product = other
+        key.save()
+        self.assertStock(product, 1, 0)
+        self.assertStock(other, 1, 0)
+
+        key.delete()
+        self.assertStock(other, 0, 0)
+
+    def test_allocation_moves_counters(self):
+        product = make_product(keys=4)
+        order = Order.objects.create(product_id=product, quantity=3, transaction_id="t1")
+
+        with transaction.atomic():
+            allocate_keys(order, product, 3)
+
+        self.assertStock(product, 1, 3)
+
+    def test_product_save_keeps_counters(self):
+        product = make_product(keys=3)
+        stale = Product.objects.get(pk=product.pk)
+        Product.adjust_stock(product.pk, available=-2, used=2)
+        stale.name = "Renamed"
+        stale.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.name, "Renamed")
+        self.assertStock(product, 1, 2)
+
+    def test_cascade_deletes_move_counters(self):
+        product = make_product(keys=5)
+        order = Order.objects.create(product_id=product, quantity=2, transaction_id="t1")
+        with transaction.atomic():
+            allocate_keys(order, product, 2)
+
+        order.delete()  # takes its used keys along through used_order
+        self.assertStock(product, 3, 0)
+        ProductKeys.objects.filter(product=product)[:1].get().delete()
+        ProductKeys.objects.filter(product=product).delete()
+        self.assertStock(product, 0, 0)
+        call_command("rebuild_stock_counters", "--check", stdout=StringIO())
+
+    def test_rebuild_command_repairs_drift(self):
+        product = make_product(keys=3)
+        Product.objects.filter(pk=product.pk).update(available_keys=9)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_stock_counters", "--check", stdout=StringIO())
+        call_command("rebuild_stock_counters", stdout=StringIO())
+
+        self.assertStock(product, 3, 0)
+        call_command("rebuild_stock_counters", "--check", stdout=StringIO())
+
+
+class PurchaseReplayTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(keys=5)
+        self.user = User.objects.create(username="reseller")
+        self.client.force_authenticate(self.user)
+
+    def purchase(self, transaction_id="trx-1", quantity=2):
+        return self.client.post("/product/purchase/", {
+            "product_id": self.product.id,
+            "transaction_id": transaction_id,
+            "quantity": quantity,
+        }, format="json")
+
+    def test_retry_returns_original_order(self):
+        first = self.purchase()
+        cache.clear()
+        retry = self.purchase()
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data["id"], first.data["id"])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderLines.objects.count(), 2)
+
+    def test_cached_retry_skips_the_database(self):
+        first = self.purchase()
+        with self.assertNumQueries(0):
+            retry = self.purchase()
+        self.assertEqual(retry.data["id"], first.data["id"])
+
+    def test_transaction_ids_are_scoped_per_client(self):
+        self.purchase()
+        self.client.force_authenticate(User.objects.create(username="other"))
+        self.purchase()
+
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_verify_only_finds_own_transactions(self):
+        mine = self.purchase()
+        other = User.objects.create(username="other")
+        self.client.force_authenticate(other)
+        theirs = self.purchase()
+
+        response = self.client.post("/transaction/verify/", {"transaction_id": "trx-1"}, format="json")
+        self.assertEqual(response.data["id"], theirs.data["id"])
+        self.client.force_authenticate(self.user)
+        response = self.client.post("/transaction/verify/", {"transaction_id": "trx-1"}, format="json")
+        self.assertEqual(response.data["id"], mine.data["id"])
+
+    def test_twin_past_the_cache_lock_replays(self):
+        # A twin served by another process: its cache shows no lock and
+        # the first request's orders were not committed when it looked.
+        lookups = []
+
+        def replay(*args):
+            lookups.append(args)
+            return None if len(lookups) == 1 else get_replayed_purchase(*args)
+
+        first = self.purchase()
+        cache.clear()
+        with mock.patch("products.views.get_replayed_purchase", side_effect=replay):
+            retry = self.purchase()
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data["id"], first.data["id"])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(PurchaseTransaction.objects.get().created_by, self.user)
+
+    def test_failed_purchase_releases_the_transaction_id(self):
+        response = self.purchase(quantity=9)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PurchaseTransaction.objects.exists())
+        self.assertEqual(self.purchase().status_code, 201)
+
+
+class LowStockNotificationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(keys=10, stock_warning_threshold=5)
+        self.client.force_authenticate(User.objects.create(username="reseller"))
+
+    def buy(self, quantity=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/product/purchase/", {
+                "product_id": self.product.id,
+                "transaction_id": f"trx-{Order.objects.count()}",
+                "quantity": quantity,
+            }, format="json")
+        self.assertEqual(response.status_code, 201)
+
+    def test_one_notification_per_threshold_crossing(self):
+        self.buy(4)
+        self.assertFalse(Notification.objects.exists())
+
+        self.buy()
+        self.buy()
+        self.buy()  # within the debounce window
+        self.assertIn("Only 4 keys left", Notification.objects.get().message)
+
+        cache.clear()
+        self.buy()
+        notification = Notification.objects.get()
+        self.assertIn("Only 2 keys left", notification.message)
+
+        notification.is_read = True
+        notification.save()
+        self.buy()
+        self.assertEqual(Notification.objects.count(), 1)
+
+        for i in range(6):
+            ProductKeys.objects.create(product=self.product, pin=f"restock-{i}")
+        self.buy()  # back above the threshold re-arms the warning
+        self.buy(2)
+        self.assertEqual(Notification.objects.filter(is_read=False).count(), 1)
+        self.assertEqual(Notification.objects.count(), 2)
+
+
+class BasketPurchaseTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.cards = make_product(keys=4, price=1000)
+        self.games = make_product(keys=2, price=2500)
+        self.client.force_authenticate(User.objects.create(username="reseller"))
+
+    def buy(self, lines, transaction_id="basket-1"):
+        return self.client.post("/product/purchase/basket/", {
+            "transaction_id": transaction_id,
+            "lines": lines,
+        }, format="json")
+
+    def test_buys_every_line_in_one_transaction(self):
+        response = self.buy([
+            {"product_id": self.cards.id, "quantity": 3},
+            {"product_id": self.games.id, "quantity": 2},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["total_price"], 3 * 1000 + 2 * 2500)
+        self.assertEqual([len(order["Cards"]) for order in response.data["orders"]], [3, 2])
+        self.cards.refresh_from_db()
+        self.assertEqual(self.cards.qty, 1)
+
+    def test_short_line_rolls_back_whole_basket(self):
+        response = self.buy([
+            {"product_id": self.cards.id, "quantity": 1},
+            {"product_id": self.games.id, "quantity": 3},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(ProductKeys.objects.filter(is_used=True).exists())
+
+    def test_retry_replays_basket(self):
+        first = self.buy([{"product_id": self.cards.id, "quantity": 1}])
+        cache.clear()
+        retry = self.buy([{"product_id": self.cards.id, "quantity": 1}])
+
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_transaction_id_is_not_replayed_across_endpoints(self):
+        self.buy([{"product_id": self.cards.id, "quantity": 1}])
+        single = self.client.post("/product/purchase/", {
+            "product_id": self.cards.id, "transaction_id": "basket-1", "quantity": 1,
+        }, format="json")
+        self.assertEqual(single.status_code, 409)
+
+        self.client.post("/product/purchase/", {
+            "product_id": self.cards.id, "transaction_id": "single-1", "quantity": 1,
+        }, format="json")
+        cache.clear()
+        basket = self.buy([{"product_id": self.cards.id, "quantity": 1}], "single-1")
+        self.assertEqual(basket.status_code, 409)
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class OrderRenderingQueryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(keys=40)
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def order(self, quantity):
+        with impersonate(self.admin):
+            order = Order.objects.create(
+                product_id=self.product, quantity=quantity,
+                transaction_id=f"trx-{quantity}")
+            with transaction.atomic():
+                allocate_keys(order, self.product, quantity)
+        return order
+
+    def assertConstantQueries(self, request):
+        counts = []
+        for quantity in (1, 20):
+            order = self.order(quantity)
+            with CaptureQueriesContext(connection) as queries:
+                response = request(order)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_transaction_verify(self):
+        def verify(order):
+            response = self.client.post(
+                "/transaction/verify/", {"transaction_id": order.transaction_id}, format="json")
+            self.assertEqual(response.data["id"], order.id)
+            return response
+
+        self.assertConstantQueries(verify)
+
+    def test_admin_order_detail(self):
+        self.assertConstantQueries(lambda order: self.client.get(f"/order/{order.id}/"))
+
+    def test_admin_order_list(self):
+        self.assertConstantQueries(lambda order: self.client.get("/order/"))
+
+    def test_revenu(self):
+        self.assertConstantQueries(lambda order: self.client.get("/order/revenu/"))
+
+    def test_purchase_response(self):
+        counts = []
+        for quantity in (1, 20):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post("/product/purchase/", {
+                    "product_id": self.product.id,
+                    "transaction_id": f"purchase-{quantity}",
+                    "quantity": quantity,
+                }, format="json")
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(queries))
+        # Plus the DailySales INSERT (savepoint, INSERT, release) of the
+        # day's first sale.
+        self.assertEqual(counts[0], counts[1] + 3)
+
+
+class ProductAdminKeysTests(APITestCase):
+    def setUp(self):
+        self.product = make_product(keys=15)
+        ProductKeys.objects.filter(pin=f"PIN-{self.product.id}-0").update(is_deleted=True)
+        Product.recount_stock()
+        self.client.force_authenticate(
+            User.objects.create(username="admin", is_staff=True))
+
+    def test_list_returns_summaries_only(self):
+        make_product(keys=30)
+        with self.assertNumQueries(2):  # count + page
+            response = self.client.get("/admin-products/")
+
+        product = response.data["results"][0]
+        self.assertNotIn("keys", product)
+        self.assertEqual(product["keys_summary"], {"available": 14, "used": 0})
+
+    def test_expand_embeds_live_keys(self):
+        response = self.client.get(f"/admin-products/{self.product.id}/?expand=keys")
+
+        self.assertEqual(len(response.data["keys"]), 14)
+
+    def test_keys_endpoint_is_paginated_and_filtered(self):
+        response = self.client.get(f"/admin-products/{self.product.id}/keys/")
+
+        self.assertEqual(response.data["count"], 14)
+        self.assertEqual(len(response.data["results"]), 10)
+        response = self.client.get(f"/admin-products/{self.product.id}/keys/?is_used=true")
+        self.assertEqual(response.data["count"], 0)
+
+
+class KeyImportTests(APITestCase):
+    def setUp(self):
+        self.product = make_product(keys=1)
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def upload(self, name, content, **data):
+        return self.client.post(
+            f"/admin-products/{self.product.id}/import_keys/",
+            {"file": SimpleUploadedFile(name, content.encode()), **data},
+            format="multipart",
+        )
+
+    def test_csv_import_rejects_duplicates_per_row(self):
+        existing = self.product.keys.get().pin
+        response = self.upload("keys.csv", "\n".join([
+            "pin,serial_no", "A,SN-A", f"{existing},", "A,", ",SN-X", "B,",
+        ]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["imported"], 2)
+        self.assertEqual(response.data["rejects"], [
+            {"row": 3, "pin": existing, "reason": "Pin already exists."},
+            {"row": 4, "pin": "A", "reason": "Duplicate pin in this file."},
+            {"row": 5, "pin": "", "reason": "Missing pin."},
+        ])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.qty, 3)
+        key = self.product.keys.get(pin="A")
+        self.assertEqual((key.serial_no_value, key.created_by), ("SN-A", self.admin))
+
+    def test_ndjson_import(self):
+        response = self.upload("keys.ndjson", '{"pin": "A"}\nnot json\n\n{"pin": "B", "serial_no": 7}\n')
+
+        self.assertEqual(response.data["imported"], 2)
+        self.assertEqual(response.data["rejects"], [{"row": 2, "pin": None, "reason": "Invalid JSON."}])
+        self.assertEqual(self.product.keys.get(pin="B").serial_no_value, "7")
+
+    def test_unreadable_upload(self):
+        response = self.upload("keys.csv", "serial_no\nSN-1\n")
+        self.assertEqual(response.status_code, 400)
+        response = self.upload("keys.txt", "pin\nA\n", file_format="xlsx")
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_utf8_keeps_committed_chunks(self):
+        rows = parse_rows(BytesIO(b"pin\nA\nB\nC\n\xff\nD\n"), "csv")
+        importer = KeyImport(self.product, chunk_size=2)
+        with self.assertRaisesMessage(ImportFormatError, "Row 5 is not valid UTF-8."):
+            importer.run(rows)
+        self.assertEqual(importer.imported, 2)
+
+        response = self.client.post(
+            f"/admin-products/{self.product.id}/import_keys/",
+            {"file": SimpleUploadedFile("keys.csv", b"pin\n\xffA\n")}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["message"], "Row 2 is not valid UTF-8.")
+
+    def test_rejects_nul_bytes(self):
+        response = self.upload("keys.csv", "pin,serial_no\nA\x00B,\nC,S\x00N\n")
+        self.assertEqual(response.data["imported"], 0)
+        self.assertEqual([reject["reason"] for reject in response.data["rejects"]], [
+            "Pin contains a NUL character.", "Serial number contains a NUL character."])
+
+    def test_counters_move_once_per_chunk(self):
+        rows = [(number, f"P{number}", None, None) for number in range(5)]
+        with CaptureQueriesContext(connection) as queries:
+            result = KeyImport(self.product, chunk_size=2).run(rows).result()
+
+        self.assertEqual(result["imported"], 5)
+        counter_updates = [q for q in queries if q["sql"].startswith('UPDATE "products_product"')]
+        self.assertEqual(len(counter_updates), 3)
+
+
+class LoadKeysCommandTests(TestCase):
+    def load(self, content, suffix=".csv", **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / f"keys{suffix}"
+            path.write_text(content)
+            out, err = StringIO(), StringIO()
+            call_command("load_keys", self.product.id, str(path), stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def setUp(self):
+        self.product = make_product(keys=1)
+
+    def test_loads_new_pins_and_refreshes_counters(self):
+        existing = self.product.keys.get().pin
+        out, err = self.load(f"pin,serial_no\nA,SN-A\nB,\nA,\n{existing},\n,x\n")
+
+        self.assertIn("Loaded 2 key(s)", out)
+        self.assertIn("rejected 3", out)
+        self.assertIn("rows/s", out)
+        self.assertIn("Row 6: Missing pin.", err)
+        self.assertEqual(self.product.keys.get(pin="A").serial_no_value, "SN-A")
+        self.assertIsNone(self.product.keys.get(pin="B").serial_no_value)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.qty, 3)
+
+    def test_ndjson_and_bad_input(self):
+        out, _ = self.load('{"pin": "N1"}\n{"pin": "N2"}\n', suffix=".ndjson")
+        self.assertIn("Loaded 2 key(s)", out)
+        with self.assertRaisesMessage(CommandError, "pin column"):
+            self.load("serial_no\nx\n")
+
+    @skipUnless(connection.vendor == "postgresql", "COPY is only used on PostgreSQL")
+    def test_copy_merges_new_pins(self):
+        user = User.objects.create(username="loader")
+        existing = self.product.keys.get().pin
+        _, err = self.load(f"pin,serial_no\nA,SN-A\nA,\n{existing},\n", username="loader")
+
+        key = self.product.keys.get(pin="A")
+        self.assertEqual((key.serial_no_value, key.created_by, key.updated_by), ("SN-A", user, user))
+        self.assertEqual(self.product.keys.count(), 2)
+        self.assertEqual(err, "")
+
+    def test_copy_stream_round_trips_rows(self):
+        rows = [(1, "A", None), (2, 'quo"te,comma', "S\n2")] * 700
+        stream = CopyStream(iter(rows))
+        chunks = iter(lambda: stream.read(1024), b"")
+        parsed = list(csv.reader(StringIO(b"".join(chunks).decode(), newline="")))
+        self.assertEqual(parsed, [[str(n), pin, serial or ""] for n, pin, serial in rows])
+
+
+class BulkKeyActionsTests(APITestCase):
+    def setUp(self):
+        self.product = make_product(keys=6)
+        self.other = make_product(keys=2)
+        self.keys = list(self.product.keys.order_by("id"))
+        ProductKeys.objects.filter(pk=self.keys[0].pk).update(is_used=True)
+        Product.recount_stock()
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def post(self, action, data=None, query=""):
+        return self.client.post(f"/admin-products-keys/bulk_{action}/{query}", data or {}, format="json")
+
+    def available(self, product):
+        product.refresh_from_db()
+        return product.qty
+
+    def test_delete_by_ids_skips_used_keys(self):
+        response = self.post("delete", {"ids": [key.pk for key in self.keys[:3]]})
+
+        self.assertEqual(
+            (response.data["matched"], response.data["affected"], response.data["skipped"]), (3, 2, 1))
+        self.assertEqual(self.available(self.product), 3)
+        deleted = ProductKeys.objects.filter(is_deleted=True)
+        self.assertEqual(set(deleted.values_list("updated_by", flat=True)), {self.admin.pk})
+        call_command("rebuild_stock_counters", check=True, stdout=StringIO())
+
+    def test_filtered_delete_then_restore(self):
+        response = self.post("delete", query=f"?product={self.product.id}")
+        self.assertEqual(response.data["affected"], 5)
+        self.assertEqual(self.available(self.product), 0)
+        self.assertEqual(self.available(self.other), 2)
+
+        response = self.post("restore", query=f"?product={self.product.id}")
+        self.assertEqual(response.data["affected"], 5)
+        self.assertEqual(self.available(self.product), 5)
+        call_command("rebuild_stock_counters", check=True, stdout=StringIO())
+
+    def test_reassign(self):
+        response = self.post("reassign", {"ids": [key.pk for key in self.keys], "product": self.other.id})
+
+        self.assertEqual(response.data["affected"], 5)
+        self.assertEqual((self.available(self.product), self.available(self.other)), (0, 7))
+        self.assertEqual(ProductKeys.objects.get(pk=self.keys[0].pk).product, self.product)
+        call_command("rebuild_stock_counters", check=True, stdout=StringIO())
+
+    def test_requires_ids_or_a_filter(self):
+        self.assertEqual(self.post("delete").status_code, 400)
+        self.assertEqual(self.post("reassign", {"ids": [self.keys[1].pk]}).status_code, 400)
+        for query in ("?product=", "?search=", "?search=%20&is_used=&product=",
+                      "?is_used=false", "?is_used=true"):
+            self.assertEqual(self.post("delete", query=query).status_code, 400)
+        self.assertFalse(ProductKeys.objects.filter(is_deleted=True).exists())
+
+    def test_one_update_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            affected = bulk_update_keys(ProductKeys.objects.all(), "delete", chunk_size=3)
+
+        self.assertEqual(affected, 7)
+        updates = [q for q in queries if q["sql"].startswith('UPDATE "products_productkeys"')]
+        self.assertEqual(len(updates), 3)
+
+
+class ProductKeyListingQueryTests(APITestCase):
+    def test_page_costs_a_fixed_number_of_queries(self):
+        self.client.force_authenticate(
+            User.objects.create(username="admin", is_staff=True))
+        counts = []
+        for keys in (1, 8):
+            product = make_product(keys=keys + 2)
+            order = Order.objects.create(product_id=product, quantity=2, transaction_id="t")
+            with transaction.atomic():
+                allocate_keys(order, product, 2)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f"/admin-products-keys/?product={product.id}")
+            self.assertEqual(len(response.data["results"]), keys + 2)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        used_id = ProductKeys.objects.filter(used_order=order).values_list("id", flat=True)[0]
+        used = next(key for key in response.data["results"] if key["id"] == used_id)
+        self.assertEqual(used["fib_order_number"], "t")
+        self.assertEqual(used["product_keys_left"], 8)
+
+
+class DailySalesTests(APITestCase):
+    def test_rollup_follows_orders_and_rebuild_matches(self):
+        cards = make_product(keys=10, price=1000)
+        games = make_product(keys=10, price=2500)
+        for product, qty in ((cards, 2), (cards, 3), (games, 1)):
+            order = Order.objects.create(product_id=product, quantity=qty, transaction_id="t")
+            with transaction.atomic():
+                allocate_keys(order, product, qty)
+
+        today = timezone.now().date().isoformat()
+        url = f"/order/total_sold_per_product_per_day/?start_date={today}&end_date={today}"
+        with self.assertNumQueries(1):
+            live = self.client.get(url).data["data"]
+
+        self.assertEqual(
+            [(row["product_id"], row["total_sold"], row["total_price"]) for row in live],
+            [(cards.id, 5, 5000), (games.id, 1, 2500)],
+        )
+        call_command("rebuild_daily_sales", stdout=StringIO())
+        self.assertEqual(self.client.get(url).data["data"], live)
+
+    def test_price_changes_and_deletes_keep_the_rollup_true(self):
+        product = make_product(keys=10, price=1000)
+        orders = []
+        for qty in (2, 3):
+            order = Order.objects.create(product_id=product, quantity=qty, transaction_id="t")
+            with transaction.atomic():
+                allocate_keys(order, product, qty)
+            orders.append(order)
+
+        product.price = 4000
+        product.save()
+        call_command("rebuild_daily_sales", stdout=StringIO())
+        self.assertEqual(
+            DailySales.objects.values_list("quantity", "revenue").get(), (5, 5000))
+
+        orders[0].delete()
+        self.assertEqual(
+            DailySales.objects.values_list("quantity", "revenue").get(), (3, 3000))
+
+
+class RevenuCursorPaginationTests(APITestCase):
+    def test_walks_every_line_once_in_order(self):
+        product = make_product(keys=30)
+        for i in range(6):
+            order = Order.objects.create(product_id=product, quantity=5, transaction_id=f"t{i}")
+            with transaction.atomic():
+                allocate_keys(order, product, 5)
+
+        seen = []
+        url = "/order/revenu/?pagination=cursor&page_size=7"
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            seen.extend(line["id"] for line in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(seen, sorted(OrderLines.objects.values_list("id", flat=True)))
+        self.assertNotIn("count", response.data)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.product = make_product(keys=6, price=1000)
+        for i in range(2):
+            order = Order.objects.create(product_id=self.product, quantity=3, transaction_id=f"t{i}")
+            with transaction.atomic():
+                allocate_keys(order, self.product, 3)
+        self.client.force_authenticate(
+            User.objects.create(username="admin", is_staff=True))
+
+    def test_streams_csv_lines(self):
+        response = self.client.get("/order/export/?kind=lines&file_format=csv")
+
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]["transaction_id"], "t0")
+        self.assertEqual(rows[0]["price"], "1000")
+
+    def test_streams_ndjson_orders(self):
+        response = self.client.get("/order/export/?kind=orders&file_format=ndjson")
+
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["total_price"] for row in rows], [3000, 3000])
+
+    def test_exports_the_price_paid(self):
+        self.product.price = 5000
+        self.product.save()
+
+        for kind, field, expected in (("orders", "total_price", 3000), ("lines", "price", 1000)):
+            response = self.client.get(f"/order/export/?kind={kind}&file_format=ndjson")
+            rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+            self.assertEqual({row[field] for row in rows}, {expected})
+
+    def test_command_matches_endpoint(self):
+        out = StringIO()
+        call_command("export_sales", "--kind", "orders", "--format", "ndjson", stdout=out)
+        response = self.client.get("/order/export/?kind=orders&file_format=ndjson")
+
+        self.assertEqual(out.getvalue().encode(), b"".join(response.streaming_content))
+
+    def test_command_shares_the_endpoint_filters(self):
+        tomorrow = (timezone.now().date() + timedelta(days=1)).isoformat()
+        out = StringIO()
+        call_command("export_sales", "--start", tomorrow, stdout=out)
+        self.assertEqual(out.getvalue().count("\n"), 1)  # header only
+
+        with self.assertRaisesMessage(CommandError, "--start: Invalid date format"):
+            call_command("export_sales", "--start", "yesterday", stdout=StringIO())
+
+
+class RevenueSummaryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(keys=10, price=1000)
+        self.alice = User.objects.create(username="alice")
+        self.bob = User.objects.create(username="bob")
+        self.client.force_authenticate(
+            User.objects.create(username="admin", is_staff=True))
+
+    def sell(self, user, quantity, days_ago=0):
+        order = Order.objects.create(
+            product_id=self.product, quantity=quantity, transaction_id="t", created_by=user)
+        with impersonate(user), transaction.atomic():
+            allocate_keys(order, self.product, quantity)
+        OrderLines.objects.filter(order=order).update(
+            created=timezone.now() - timedelta(days=days_ago))
+
+    def test_totals_and_cached_closed_days(self):
+        self.sell(self.alice, 3, days_ago=2)
+        self.sell(self.bob, 1, days_ago=1)
+        self.sell(self.alice, 1)
+
+        response = self.client.get("/order/summary/")
+        self.assertEqual(response.data["total_revenue"], 5000)
+        self.assertEqual(response.data["total_cards"], 5)
+        self.assertEqual(
+            [(row["username"], row["cards"]) for row in response.data["resellers"]],
+            [("alice", 4), ("bob", 1)],
+        )
+
+        self.sell(self.bob, 2)
+        with self.assertNumQueries(1):  # today's bucket only
+            response = self.client.get("/order/summary/")
+        self.assertEqual(response.data["total_cards"], 7)
+
+    def test_username_filter(self):
+        self.sell(self.alice, 2)
+        self.sell(self.bob, 1)
+
+        response = self.client.get("/order/summary/?username=bob")
+        self.assertEqual(response.data["total_revenue"], 1000)
+
+    def test_price_changes_leave_past_revenue_alone(self):
+        self.sell(self.alice, 2, days_ago=1)
+        self.client.get("/order/summary/")
+        self.product.price = 5000
+        self.product.save()
+
+        cached = self.client.get("/order/summary/").data["total_revenue"]
+        cache.clear()
+        fresh = self.client.get("/order/summary/").data["total_revenue"]
+        self.assertEqual((cached, fresh), (2000, 2000))
+
+
+class ResellerSalesTests(APITestCase):
+    def test_buckets_per_reseller(self):
+        product = make_product(price=1000)
+        alice = User.objects.create(username="alice")
+        bob = User.objects.create(username="bob")
+        now = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        Order.objects.bulk_create([
+            Order(product_id=product, quantity=2, transaction_id="a1", created_by=alice,
+                  created=now, unit_price=1000),
+            Order(product_id=product, quantity=1, transaction_id="a2", created_by=alice,
+                  created=now + timedelta(minutes=5), unit_price=1000),
+            Order(product_id=product, quantity=4, transaction_id="b1", created_by=bob,
+                  created=now - timedelta(days=1), unit_price=1000),
+        ])
+        self.client.force_authenticate(User.objects.create(username="admin", is_staff=True))
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/order/reseller_sales/?granularity=day")
+
+        self.assertEqual(
+            [(row["username"], row["orders"], row["cards"], row["revenue"]) for row in response.data["data"]],
+            [("bob", 1, 4, 4000), ("alice", 2, 3, 3000)],
+        )
+        response = self.client.get(f"/order/reseller_sales/?granularity=hour&reseller={alice.id}")
+        self.assertEqual(len(response.data["data"]), 1)
+        self.assertEqual(self.client.get("/order/reseller_sales/?granularity=year").status_code, 400)
+        for reseller in ("abc", "0", "-1"):
+            response = self.client.get(f"/order/reseller_sales/?reseller={reseller}")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data["message"], "Must be a positive user id.")
+
+    def test_revenue_keeps_the_price_paid(self):
+        product = make_product(keys=2, price=1000)
+        alice = User.objects.create(username="alice")
+        with impersonate(alice):
+            order = Order.objects.create(product_id=product, quantity=2, transaction_id="t")
+            with transaction.atomic():
+                allocate_keys(order, product, 2)
+        product.price = 5000
+        product.save()
+        self.client.force_authenticate(User.objects.create(username="admin", is_staff=True))
+
+        response = self.client.get("/order/reseller_sales/")
+        self.assertEqual([row["revenue"] for row in response.data["data"]], [2000])
+
+
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(keys=3)
+        self.client.force_authenticate(User.objects.create(username="reseller"))
+
+    def stock(self):
+        return self.client.get("/products/").data["results"][0]["stock"]
+
+    def test_steady_state_reads_skip_the_database(self):
+        self.client.get("/products/")
+        self.client.get(f"/products/{self.product.id}/")
+        with self.assertNumQueries(0):
+            self.client.get("/products/")
+            self.client.get(f"/products/{self.product.id}/")
+
+    def test_product_save_invalidates(self):
+        self.client.get("/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed"
+            self.product.save()
+
+        self.assertEqual(self.client.get("/products/").data["results"][0]["name"], "Renamed")
+
+    def test_only_availability_flips_invalidate(self):
+        self.assertTrue(self.stock())
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(product_id=self.product, quantity=2, transaction_id="t")
+            with transaction.atomic():
+                allocate_keys(order, self.product, 2)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.stock())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(product_id=self.product, quantity=1, transaction_id="t")
+            with transaction.atomic():
+                allocate_keys(order, self.product, 1)
+        self.assertFalse(self.stock())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductKeys.objects.create(product=self.product, pin="restock")
+        self.assertTrue(self.stock())
+
+    def test_evicted_version_does_not_revive_stale_entries(self):
+        self.client.get("/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed"
+            self.product.save()
+        cache.delete(CATALOG_VERSION_KEY)
+
+        self.assertEqual(self.client.get("/products/").data["results"][0]["name"], "Renamed")
+
+    def test_version_expires_without_a_shared_cache(self):
+        # Stands in for the few seconds a per-process cache keeps it.
+        with override_settings(CATALOG_VERSION_TIMEOUT=0):
+            first = self.client.get("/products/")
+            self.assertNotEqual(self.client.get("/products/")["ETag"], first["ETag"])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(keys=3)
+        self.notification = Notification.objects.create(message="Low", product=self.product)
+        self.client.force_authenticate(User.objects.create(username="reseller"))
+
+    def test_unchanged_catalog_poll_is_not_modified(self):
+        etag = self.client.get("/products/")["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get("/products/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_notification_poll(self):
+        first = self.client.get("/notifications/")
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/notifications/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        # The ETag also covers the embedded products; a date can't.
+        self.assertNotIn("Last-Modified", first)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed"
+            self.product.save()
+        response = self.client.get(
+            "/notifications/", HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/notifications/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        first = response
+
+        self.client.patch(f"/notifications/{self.notification.id}/mark_as_read/")
+        response = self.client.get("/notifications/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 0)
+
+
+class EnvelopeRendererTests(TestCase):
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+
+    def render(self, data):
+        return json.loads(self.renderer.render(data))
+
+    def test_dict_payload_is_merged(self):
+        self.assertEqual(
+            self.render({"count": 1, "price": Decimal("9.50")}),
+            {"status": True, "message": "Success", "count": 1, "price": 9.5},
+        )
+        self.assertEqual(self.render({}), {"status": True, "message": "Success"})
+
+    def test_error_payload(self):
+        self.assertEqual(
+            self.render({"error": "Boom", "transaction_id": "T1"}),
+            {"status": False, "message": "Boom", "error": "Boom", "transaction_id": "T1"},
+        )
+        self.assertEqual(
+            self.render({"status": False, "message": "Nope"}),
+            {"status": False, "message": "Nope"},
+        )
+
+    def test_non_dict_payload_goes_under_data(self):
+        self.assertEqual(
+            self.render([{"id": 1}]), {"status": True, "message": "Success", "data": [{"id": 1}]})
+        self.assertEqual(self.render("ok"), {"status": True, "message": "Success", "data": "ok"})
+        self.assertEqual(self.renderer.render(None), b"")
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("benchmark_renderer", orders=5, cards=2, repeat=1, stdout=out)
+        self.assertIn("Speedup", out.getvalue())
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        make_product(keys=2)
+        self.client.force_authenticate(User.objects.create(username="reseller"))
+
+    def scrape(self, **headers):
+        return self.client.get("/metrics", **headers)
+
+    def test_requests_are_recorded_per_view_action(self):
+        self.client.get("/products/")
+        self.client.get("/products/")
+        self.client.get("/products/999999/")
+
+        with self.settings(METRICS_TOKEN="secret"):
+            response = self.scrape(HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+
+        labels = 'view="products:product-list",action="list",method="GET"'
+        self.assertIn(f"http_request_duration_seconds_count{{{labels}}} 2", body)
+        self.assertIn(f"http_request_db_queries_count{{{labels}}} 2", body)
+        self.assertNotIn(f"http_request_db_queries_sum{{{labels}}} 0\n", body)
+        self.assertIn(f"http_response_size_bytes_count{{{labels}}} 2", body)
+        self.assertIn(f'http_requests_total{{{labels},status="200"}} 2', body)
+        self.assertIn(
+            'http_requests_total{view="products:product-detail",action="retrieve",'
+            'method="GET",status="404"} 1',
+            body,
+        )
+
+    def test_scrape_requires_token_or_staff(self):
+        self.assertEqual(self.scrape().status_code, 404)
+        with self.settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.scrape(HTTP_AUTHORIZATION="Bearer wrong").status_code, 404)
+
+        self.client.force_authenticate(None)
+        self.client.force_login(User.objects.create(username="ops", is_staff=True))
+        self.assertEqual(self.scrape().status_code, 200)
+
+
+class ServerTimingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(keys=3)
+        self.client.force_authenticate(User.objects.create(username="reseller"))
+
+    def buy(self):
+        return self.client.post("/product/purchase/", {
+            "product_id": self.product.id, "quantity": 2, "transaction_id": "T1",
+        }, format="json")
+
+    def phases(self, response):
+        return [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+
+    def test_off_by_default(self):
+        self.assertNotIn("Server-Timing", self.buy())
+
+    @override_settings(SERVER_TIMING=True)
+    def test_purchase_phases_are_reported_and_logged(self):
+        with self.assertLogs("core.timing", "INFO") as logs:
+            response = self.buy()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            self.phases(response),
+            ["auth", "replay", "validate", "allocate", "lines", "counters", "render", "total"],
+        )
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["action"], "create")
+        self.assertEqual(record["status"], 201)
+        self.assertEqual(list(record["phases"]), self.phases(response))
+
+    @override_settings(SERVER_TIMING=True)
+    def test_transaction_verify_phases(self):
+        with self.assertLogs("core.timing", "INFO"):
+            self.buy()
+            response = self.client.post(
+                "/transaction/verify/", {"transaction_id": "T1"}, format="json")
+        self.assertEqual(self.phases(response), ["auth", "lookup", "render", "total"])
+
+
+class SeedDatasetTests(TestCase):
+    def seed(self):
+        call_command(
+            "seed_dataset", products=3, keys=40, orders=30, resellers=2,
+            notifications=5, stdout=StringIO(),
+        )
+        return list(ProductKeys.objects.order_by("serial_no_value").values_list("pin", flat=True))
+
+    def test_dataset_is_consistent_and_deterministic(self):
+        pins = self.seed()
+
+        self.assertEqual(len(pins), 3 * 40)
+        self.assertEqual(
+            OrderLines.objects.count(), Order.objects.aggregate(n=Sum("quantity"))["n"])
+        self.assertFalse(ProductKeys.objects.filter(
+            is_used=True, order_line_keys__isnull=True).exists())
+        call_command("rebuild_stock_counters", check=True, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            self.seed()
+
+        User.objects.all().delete()
+        self.assertEqual(self.seed(), pins)
+
+    def test_endpoint_benchmark_against_baseline(self):
+        self.seed()
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = Path(directory) / "baseline.json"
+            call_command(
+                "benchmark_endpoints", iterations=1, warmup=0,
+                save_baseline=str(baseline), stdout=out, stderr=out)
+            results = json.loads(baseline.read_text())
+            self.assertIn("purchase", results)
+            self.assertNotIn("No benchmark case", out.getvalue())
+
+            results["purchase"]["queries"] -= 1
+            baseline.write_text(json.dumps(results))
+            with self.assertRaisesMessage(CommandError, "purchase:"):
+                call_command(
+                    "benchmark_endpoints", iterations=1, warmup=0, only=["purchase"],
+                    baseline=str(baseline), tolerance=100, stdout=StringIO())
+
+
+class LoadTestPurchasesTests(LiveServerTestCase):
+    # One worker: the in-memory SQLite test database locks whole tables, so
+    # concurrency itself is covered by ConcurrentAllocationTests.
+    def test_purchases_run_through_the_api_and_are_verified(self):
+        out = StringIO()
+        call_command(
+            "load_test_purchases", base_url=self.live_server_url, workers=1, purchases=5,
+            quantity=2, keys=9, stdout=out,
+        )
+
+        product = Product.objects.get(name__startswith="Load test")
+        self.assertEqual(OrderLines.objects.filter(product_key__product=product).count(), 8)
+        self.assertIn("4 order(s), 1 rejected, 0 failed", out.getvalue())
+        self.assertIn("No key was allocated twice", out.getvalue())
+
+    def test_double_allocation_is_reported(self):
+        product = make_product(keys=1)
+        key = product.keys.get()
+        for transaction_id in ("A", "B"):
+            order = Order.objects.create(product_id=product, quantity=1, transaction_id=transaction_id)
+            OrderLines.objects.create(order=order, product_key=key)
+
+        with self.assertRaisesMessage(CommandError, "1 key(s) are on more than one order line"):
+            LoadTestCommand(stdout=StringIO()).verify(product)
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN every hot query against a seeded dataset; none may fall back to a full scan."""
+
+    products = 20
+    keys_per_product = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        products = [make_product() for _ in range(cls.products)]
+        ProductKeys.objects.bulk_create(
+            ProductKeys(product=product, pin=f"{product.id}-{i}", is_used=i % 3 == 0)
+            for product in products for i in range(cls.keys_per_product)
+        )
+        orders = Order.objects.bulk_create(
+            Order(product_id=product, quantity=1, transaction_id=f"trx-{product.id}-{i}",
+                  created=timezone.now() - timedelta(days=i))
+            for product in products for i in range(30)
+        )
+        keys = ProductKeys.objects.filter(is_used=True)[:len(orders)]
+        OrderLines.objects.bulk_create(
+            OrderLines(order=order, product_key=key, created=order.created)
+            for order, key in zip(orders, keys)
+        )
+        Product.recount_stock()
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+        cls.product = products[len(products) // 2]
+        cls.user = User.objects.create(username="reseller")
+
+    def hot_queries(self):
+        day = timezone.now() - timedelta(days=3)
+        return {
+            "free keys for allocation": free_keys(self.product).order_by("id")[:10],
+            "stock counts": Product.counted_stock().filter(pk=self.product.pk),
+            "keys of a product": ProductKeys.objects.filter(
+                product=self.product, is_deleted=False)[:10],
+            "key listing": ProductKeys.objects.exclude(is_deleted=True)[:10],
+            "transaction lookup": Order.objects.filter(transaction_id="trx-1-1"),
+            "purchase replay": Order.objects.filter(
+                created_by=self.user, transaction_id="trx-1-1"),
+            "reseller sales": Order.objects.filter(
+                created_by=self.user, created__gte=day, created__lt=day + timedelta(days=1)),
+            "orders of a day": Order.objects.filter(
+                created__gte=day, created__lt=day + timedelta(days=1)),
+            "order lines of a day": OrderLines.objects.filter(
+                created__gte=day, created__lt=day + timedelta(days=1)),
+            "order lines after a cursor": OrderLines.objects.filter(
+                created__gt=day).order_by("created", "id")[:25],
+        }
+
+    def full_scans(self, plan):
+        # An ordered walk of an index (SQLite "SCAN t USING INDEX") is fine.
+        if connection.vendor == "postgresql":
+            return re.findall(r"Seq Scan on (\w+)", plan)
+        if connection.vendor == "sqlite":
+            return re.findall(r"SCAN (?:TABLE )?(\w+)(?! USING)\s*$", plan, re.MULTILINE)
+        self.skipTest(f"No plan parser for {connection.vendor}")
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(self.full_scans(plan), [], f"{name}:\n{plan}")
+
+
+class ConcurrentAllocationTests(TransactionTestCase):
+    workers = 8
+    per_order = 3
+
+    def test_concurrent_buyers_never_share_a_key(self):
+        product = make_product(keys=self.workers * self.per_order - 2)
+        user = User.objects.create(username="reseller")
+        barrier = threading.Barrier(self.workers)
+        results = []
+
+        def buy(n):
+            barrier.wait()
+            try:
+                for _ in range(200):
+                    try:
+                        with transaction.atomic():
+                            order = Order.objects.create(
+                                product_id=product, quantity=self.per_order,
+                                transaction_id=f"t{n}", created_by=user)
+                            allocate_keys(order, product, self.per_order)
+                        results.append(order.id)
+                        return
+                    except OperationalError:
+                        # SQLite has no row locks and reports a busy database
+                        # instead of waiting; retry like a client would.
+                        time.sleep(0.01)
+                    except NotEnoughKeys:
+                        return
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(n,)) for n in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines = OrderLines.objects.values_list("product_key_id", flat=True)
+        self.assertEqual(max(Counter(lines).values()), 1)
+        self.assertEqual(len(results), self.workers - 1)
+        self.assertEqual(len(lines), len(results) * self.per_order)
+        self.assertEqual(
+            ProductKeys.objects.filter(used_order__isnull=False).count(), len(lines))
+        for order in Order.objects.filter(id__in=results):
+            self.assertEqual(order.Cards.count(), order.quantity)
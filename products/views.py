@@ -1,26 +1,37 @@
+import hashlib
+
 from rest_framework import mixins, viewsets
-from rest_framework import filters, permissions
+from rest_framework import filters, permissions, status
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import MultiPartParser
 from drf_yasg import openapi
 from drf_yasg.utils import no_body, swagger_auto_schema
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Product, Order, ProductKeys, OrderLines, Notification
-from .serializers import ProductSerializer, ProductAdminSerializer, ProductKeysSerializer, OrderSerializer, OrderLinesSerializer, NotificationSerializer
+from .models import Product, Order, ProductKeys, OrderLines, Notification, DailySales, PurchaseTransaction
+from .serializers import expand_keys, ProductSerializer, ProductAdminSerializer, ProductKeysSerializer, OrderSerializer, OrderLinesSerializer, NotificationSerializer, BasketSerializer, BulkKeysSerializer, BulkReassignKeysSerializer
+from .exports import EXPORTS, FORMATS, export_queryset, filter_order_lines, stream_export
+from .importers import FORMATS as IMPORT_FORMATS, ImportFormatError, KeyImport, detect_format, parse_rows
+from .services import begin_purchase, bulk_update_keys, cached_purchase, catalog_cache_key, claim_purchase, catalog_version, end_purchase, get_replayed_purchase, remember_purchase, PurchaseKindMismatch
 from django_filters import rest_framework as django_filters_rest_framework
 
-from django.db.models import Sum, Count, F
-from django.db.models.functions import TruncDate
+from django.db import transaction
+from django.db.models import Sum, Count, F, Max, Prefetch, Q
+from django.db.models.functions import Trunc
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from datetime import datetime
+from datetime import datetime, timedelta
 from .models import Order
-from django.utils.dateparse import parse_date
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError as drf_exceptions
 from rest_framework.permissions import IsAdminUser
-from core.utils import StandardLimitOffsetPagination
+from core.timing import ServerTimingMixin, phase
+from core.utils import ConditionalGetMixin, OrderLinesCursorPagination, StandardLimitOffsetPagination
 
 from rest_framework.decorators import action
 
@@ -28,6 +39,28 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 
+ORDER_LINE_FILTERS = [
+    openapi.Parameter(
+        "created_after",
+        openapi.IN_QUERY,
+        description="Start date for filtering orders (YYYY-MM-DD)",
+        type=openapi.TYPE_STRING,
+    ),
+    openapi.Parameter(
+        "created_before",
+        openapi.IN_QUERY,
+        description="End date for filtering orders (YYYY-MM-DD)",
+        type=openapi.TYPE_STRING,
+    ),
+    openapi.Parameter(
+        "username",
+        openapi.IN_QUERY,
+        description="End date for filtering orders (YYYY-MM-DD)",
+        type=openapi.TYPE_STRING,
+    ),
+]
+
+
 class CustomPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"
@@ -35,7 +68,7 @@ class CustomPagination(PageNumberPagination):
 
 
 class ProductViewSet(
-    mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+    ConditionalGetMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
 ):
     queryset = Product.objects.exclude(
         is_deleted=True).exclude(status="inactive")
@@ -45,6 +78,30 @@ class ProductViewSet(
 
     permission_classes = [permissions.IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: self.cached(
+            request, lambda: super(ProductViewSet, self).list(request, *args, **kwargs)))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: self.cached(
+            request, lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs)))
+
+    def get_version_stamp(self, request):
+        # Bumped by product saves and stock flips, see products.signals.
+        return catalog_version()
+
+    def cached(self, request, render):
+        """Serve the response from the catalog cache, rendering it on a miss."""
+        key = catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = render()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
+
 
 class ProductAdminViewSet(
     viewsets.ModelViewSet
@@ -58,24 +115,91 @@ class ProductAdminViewSet(
     filterset_fields = ['status']
     search_fields = ['name', 'description']
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if expand_keys(self.request):
+            queryset = queryset.prefetch_related(
+                Prefetch("keys", queryset=ProductKeys.for_display().filter(is_deleted=False)))
+        return queryset
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         instance.is_deleted = True
         instance.save()
         return Response({"status": True, "message": "Product deleted"})
 
+    @swagger_auto_schema(
+        operation_description="Paginated keys of a product",
+        manual_parameters=[
+            openapi.Parameter(
+                "is_used",
+                openapi.IN_QUERY,
+                description="Only used (true) or only free (false) keys",
+                type=openapi.TYPE_BOOLEAN,
+            ),
+        ],
+        responses={200: ProductKeysSerializer(many=True)},
+    )
+    @action(detail=True, methods=["get"], filter_backends=[], serializer_class=ProductKeysSerializer)
+    def keys(self, request, pk=None):
+        product = self.get_object()
+        queryset = ProductKeys.for_display().filter(product=product, is_deleted=False)
+
+        is_used = request.query_params.get("is_used")
+        if is_used is not None:
+            queryset = queryset.filter(is_used=is_used.lower() in ("1", "true"))
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Bulk import keys from a CSV (pin, serial_no columns) or NDJSON "
+            "({\"pin\": ..., \"serial_no\": ...} per line) upload"
+        ),
+        manual_parameters=[
+            openapi.Parameter("file", openapi.IN_FORM, type=openapi.TYPE_FILE, required=True),
+            openapi.Parameter(
+                "file_format", openapi.IN_FORM, type=openapi.TYPE_STRING, enum=list(IMPORT_FORMATS),
+                description="Defaults to ndjson for .ndjson/.jsonl files, csv otherwise",
+            ),
+        ],
+        responses={200: "KeyImport"},
+    )
+    @action(detail=True, methods=["post"], parser_classes=[MultiPartParser], filter_backends=[])
+    def import_keys(self, request, pk=None):
+        product = self.get_object()
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise drf_exceptions({"file": "Upload a CSV or NDJSON file."})
+        file_format = detect_format(upload.name, request.data.get("file_format"))
+        if file_format not in IMPORT_FORMATS:
+            raise drf_exceptions({"file_format": f"Choose one of: {', '.join(IMPORT_FORMATS)}."})
+
+        importer = KeyImport(product, request.user)
+        try:
+            importer.run(parse_rows(upload, file_format))
+        except ImportFormatError as exc:
+            message = str(exc)
+            if importer.imported:
+                # Chunks are committed one by one and are not rolled back.
+                message += f" The {importer.imported} keys before it were imported."
+            raise drf_exceptions({"file": message})
+        return Response(importer.result())
+
 
 class ProductKeyViewSet(
     viewsets.ModelViewSet
 ):
-    queryset = ProductKeys.objects.exclude(
+    queryset = ProductKeys.for_display().exclude(
         is_deleted=True)
     serializer_class = ProductKeysSerializer
     filter_backends = [filters.SearchFilter,
                        django_filters_rest_framework.DjangoFilterBackend]
     pagination_class = CustomPagination
     permission_classes = [permissions.IsAdminUser]
-    search_fields = ['serial_no', 'pin']
+    search_fields = ['serial_no_value', 'pin']
     filterset_fields = ['is_used', 'product']
 
     def destroy(self, request, *args, **kwargs): 
@@ -84,10 +208,71 @@ class ProductKeyViewSet(
         instance.save()
         return Response({"status": True, "message": "Product deleted"})
 
+    @swagger_auto_schema(
+        operation_description="Soft-delete unused keys by id list and/or the list filters",
+        request_body=BulkKeysSerializer,
+        responses={200: "BulkKeys"},
+    )
+    @action(detail=False, methods=["post"])
+    def bulk_delete(self, request):
+        return self.bulk_update(request, "delete", BulkKeysSerializer)
+
+    @swagger_auto_schema(
+        operation_description="Restore soft-deleted unused keys by id list and/or the list filters",
+        request_body=BulkKeysSerializer,
+        responses={200: "BulkKeys"},
+    )
+    @action(detail=False, methods=["post"])
+    def bulk_restore(self, request):
+        return self.bulk_update(request, "restore", BulkKeysSerializer)
 
-class OrderViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet
+    @swagger_auto_schema(
+        operation_description="Move unused keys to another product by id list and/or the list filters",
+        request_body=BulkReassignKeysSerializer,
+        responses={200: "BulkKeys"},
+    )
+    @action(detail=False, methods=["post"])
+    def bulk_reassign(self, request):
+        return self.bulk_update(request, "reassign", BulkReassignKeysSerializer)
+
+    def bulk_update(self, request, operation, serializer_class):
+        serializer = serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get("ids")
+        # Deleted keys included, so restore can find them.
+        keys = ProductKeys.objects.all()
+        if ids is None and not self.narrowing_filters(request, keys):
+            raise drf_exceptions(
+                {"ids": "Pass ids or filter the keys by product or search."})
+
+        queryset = self.filter_queryset(keys)
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        matched = queryset.count()
+        affected = bulk_update_keys(
+            queryset, operation, serializer.validated_data.get("product"))
+        return Response({"matched": matched, "affected": affected, "skipped": matched - affected})
+
+    def narrowing_filters(self, request, queryset):
+        """The list filters that actually narrow ``queryset`` for a bulk action.
+
+        Judged on the validated values, so ``?product=`` or ``?search=``
+        with nothing after them don't count. ``is_used`` never does: bulk
+        actions only ever touch unused keys, so it can't narrow them.
+        """
+        active = []
+        if filters.SearchFilter().get_search_terms(request):
+            active.append("search")
+        filterset = django_filters_rest_framework.DjangoFilterBackend().get_filterset(
+            request, queryset, self)
+        if filterset.is_valid() and filterset.form.cleaned_data.get("product") is not None:
+            active.append("product")
+        return active
+
+
+class OrderViewSet(ServerTimingMixin, mixins.CreateModelMixin, viewsets.GenericViewSet
                    ):
-    queryset = Order.objects.all()
+    queryset = Order.for_display()
     serializer_class = OrderSerializer
     filter_backends = [filters.SearchFilter]
     pagination_class = CustomPagination
@@ -117,11 +302,85 @@ class OrderViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet
         responses={200: "OrderStats"},
     )
     def create(self, request, *args, **kwargs):
-        return super().create(request, *args, **kwargs)
+        return self.replay_or_purchase(
+            request,
+            PurchaseTransaction.KIND.single,
+            lambda orders: self.get_serializer(orders[0]).data,
+            lambda: super(OrderViewSet, self).create(request, *args, **kwargs),
+        )
+
+    @swagger_auto_schema(
+        operation_description="Buy several products in one transaction",
+        request_body=BasketSerializer,
+        responses={201: "Basket"},
+    )
+    @action(detail=False, methods=["post"])
+    def basket(self, request):
+        context = self.get_serializer_context()
+
+        def purchase():
+            serializer = BasketSerializer(data=request.data, context=context)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        return self.replay_or_purchase(
+            request,
+            PurchaseTransaction.KIND.basket,
+            lambda orders: BasketSerializer(orders, context=context).data,
+            purchase,
+        )
+
+    def replay_or_purchase(self, request, kind, serialize, purchase):
+        """Run ``purchase`` once per (client, transaction_id); replay it after that.
+
+        ``kind`` names the endpoint; a transaction id bought through one
+        endpoint is refused on the other.
+        """
+        user = request.user
+        transaction_id = request.data.get("transaction_id")
+        if not transaction_id:
+            return purchase()
+
+        def conflict(message):
+            return Response({
+                "status": False,
+                "message": message,
+                "transaction_id": transaction_id,
+            }, status=status.HTTP_409_CONFLICT)
+
+        with phase("replay"):
+            data = cached_purchase(user, transaction_id, kind)
+        if data is None:
+            if not begin_purchase(user, transaction_id):
+                return conflict("Transaction is already being processed")
+            try:
+                with phase("replay"):
+                    data = get_replayed_purchase(user, transaction_id, kind, serialize)
+                if data is None:
+                    # The cache lock is per process with a local cache; the
+                    # guard row is what stops a twin in another process.
+                    with transaction.atomic():
+                        claimed = claim_purchase(user, transaction_id, kind)
+                        if claimed:
+                            response = purchase()
+                    if claimed:
+                        remember_purchase(user, transaction_id, kind, response.data)
+                        return response
+                    with phase("replay"):
+                        data = get_replayed_purchase(user, transaction_id, kind, serialize)
+                    if data is None:
+                        return conflict("Transaction is already being processed")
+            except PurchaseKindMismatch as mismatch:
+                return conflict(f"Transaction was already used for a {mismatch} purchase")
+            finally:
+                end_purchase(user, transaction_id)
+
+        return Response(data, status=status.HTTP_201_CREATED)
 
 
 class OrderAdminViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+    queryset = Order.for_display()
     serializer_class = OrderSerializer
     filter_backends = [filters.SearchFilter]
     permission_classes = [permissions.IsAdminUser]
@@ -184,46 +443,38 @@ class OrderAdminViewSet(viewsets.ModelViewSet):
             return Response({"error": "start_date and end_date are required"}, status=400)
 
         try:
-            start_date = datetime.strptime(start_date, "%Y-%m-%d")
-            end_date = datetime.strptime(end_date, "%Y-%m-%d")
+            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
         except ValueError:
             return Response({"error": "Invalid date format. Use YYYY-MM-DD."}, status=400)
 
-        orders = (
-            Order.objects.filter(created__date__range=[start_date, end_date])
-            .values("product_id", "product_id__name")  # Group by product
-            .annotate(
-                date=TruncDate("created"),
-                total_sold=Sum("quantity"),
-                # Calculate total price
-                total_price=Sum(F("quantity") * F("product_id__price")),
-            )
-            .order_by("date")
+        sales = (
+            DailySales.objects.filter(date__range=[start_date, end_date])
+            .values_list("product_id", "product__name", "date", "quantity", "revenue")
+            .order_by("date", "product_id")
         )
 
         return Response({
-            "data": list(orders)
+            "data": [
+                {
+                    "product_id": product_id,
+                    "product_id__name": name,
+                    "date": date,
+                    "total_sold": quantity,
+                    "total_price": revenue,
+                }
+                for product_id, name, date, quantity, revenue in sales
+            ]
         })
 
     @swagger_auto_schema(
         operation_description="Get stats for orders within a date range",
         manual_parameters=[
+            *ORDER_LINE_FILTERS,
             openapi.Parameter(
-                "created_after",
-                openapi.IN_QUERY,
-                description="Start date for filtering orders (YYYY-MM-DD)",
-                type=openapi.TYPE_STRING,
-            ),
-            openapi.Parameter(
-                "created_before",
-                openapi.IN_QUERY,
-                description="End date for filtering orders (YYYY-MM-DD)",
-                type=openapi.TYPE_STRING,
-            ),
-            openapi.Parameter(
-                "username",
+                "pagination",
                 openapi.IN_QUERY,
-                description="End date for filtering orders (YYYY-MM-DD)",
+                description="'cursor' to page with stable cursors over (created, id) instead of page numbers",
                 type=openapi.TYPE_STRING,
             ),
         ],
@@ -232,43 +483,18 @@ class OrderAdminViewSet(viewsets.ModelViewSet):
     @action(
         detail=False,
         methods=["get"],
-        filter_backends=None,
+        filter_backends=[],
         pagination_class=StandardLimitOffsetPagination,
         permission_classes=[permissions.AllowAny],
     )
     def revenu(self, request):
-        queryset = OrderLines.objects.all()
-        start_date = request.query_params.get("created_after")
-        end_date = request.query_params.get("created_before")
-        username = request.query_params.get("username")
+        queryset = filter_order_lines(OrderLines.for_display(), request.query_params)
 
-        if start_date:
-            try:
-                start_date = parse_date(start_date)
-                if not start_date:
-                    raise ValueError
-            except ValueError:
-                raise drf_exceptions(
-                    {"created_after": "Invalid date format. Use YYYY-MM-DD."}
-                )
-            queryset = queryset.filter(created__gte=start_date)
-
-        if end_date:
-            try:
-                end_date = parse_date(end_date)
-                if not end_date:
-                    raise ValueError
-            except ValueError:
-                raise drf_exceptions(
-                    {"created_before": "Invalid date format. Use YYYY-MM-DD."}
-                )
-            queryset = queryset.filter(created__lte=end_date)
-
-        if username:
-            queryset = queryset.filter(
-                created_by__username__icontains=username)
-
-        paginator = StandardLimitOffsetPagination()
+        if request.query_params.get("pagination") == "cursor" or "cursor" in request.query_params:
+            paginator = OrderLinesCursorPagination()
+        else:
+            paginator = StandardLimitOffsetPagination()
+            queryset = queryset.order_by("created", "id")
 
         page = paginator.paginate_queryset(queryset, request, view=self)
         if page is not None:
@@ -282,9 +508,172 @@ class OrderAdminViewSet(viewsets.ModelViewSet):
             "total": queryset.count(),
         })
 
+    @swagger_auto_schema(
+        operation_description="Orders, cards and revenue per reseller per time bucket",
+        manual_parameters=[
+            openapi.Parameter(
+                "granularity",
+                openapi.IN_QUERY,
+                description="hour, day (default), week or month",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "start_date",
+                openapi.IN_QUERY,
+                description="Start date in YYYY-MM-DD format (default: 30 days ago)",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "end_date",
+                openapi.IN_QUERY,
+                description="End date in YYYY-MM-DD format, inclusive (default: today)",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "reseller",
+                openapi.IN_QUERY,
+                description="Only this reseller's user id",
+                type=openapi.TYPE_INTEGER,
+            ),
+        ],
+        responses={200: "ResellerSales"},
+    )
+    @action(detail=False, methods=["get"], filter_backends=[], pagination_class=None)
+    def reseller_sales(self, request):
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in ("hour", "day", "week", "month"):
+            return Response({"error": "granularity must be one of hour, day, week, month"}, status=400)
+
+        today = timezone.now().date()
+        try:
+            start_date = datetime.strptime(
+                request.query_params.get("start_date", str(today - timedelta(days=30))), "%Y-%m-%d").date()
+            end_date = datetime.strptime(
+                request.query_params.get("end_date", str(today)), "%Y-%m-%d").date()
+        except ValueError:
+            return Response({"error": "Invalid date format. Use YYYY-MM-DD."}, status=400)
+
+        orders = Order.objects.filter(
+            created__gte=start_date, created__lt=end_date + timedelta(days=1))
+        reseller = request.query_params.get("reseller")
+        if reseller:
+            if not reseller.isdigit() or not int(reseller):
+                raise drf_exceptions({"reseller": "Must be a positive user id."})
+            orders = orders.filter(created_by=int(reseller))
+
+        sales = (
+            orders.annotate(bucket=Trunc("created", granularity))
+            .values("bucket", "created_by", "created_by__username")
+            .annotate(
+                orders=Count("id"),
+                cards=Sum("quantity"),
+                revenue=Sum(F("quantity") * F("unit_price")),
+            )
+            .order_by("bucket", "created_by")
+        )
+
+        return Response({
+            "granularity": granularity,
+            "data": [
+                {
+                    "reseller_id": row["created_by"],
+                    "username": row["created_by__username"],
+                    "bucket": row["bucket"],
+                    "orders": row["orders"],
+                    "cards": row["cards"],
+                    "revenue": row["revenue"] or 0,
+                }
+                for row in sales
+            ],
+        })
+
+    @swagger_auto_schema(
+        operation_description="Revenue, cards sold and per-reseller totals for a date range",
+        manual_parameters=ORDER_LINE_FILTERS,
+        responses={200: "RevenueSummary"},
+    )
+    @action(detail=False, methods=["get"], filter_backends=[], pagination_class=None)
+    def summary(self, request):
+        queryset = filter_order_lines(OrderLines.objects.all(), request.query_params)
+        today = timezone.now().date()
+
+        # Days before today can no longer change; only today is recomputed.
+        key = "revenue-summary:" + hashlib.sha256(repr((
+            today,
+            request.query_params.get("created_after"),
+            request.query_params.get("created_before"),
+            request.query_params.get("username"),
+        )).encode()).hexdigest()
+        closed = cache.get(key)
+        if closed is None:
+            closed = revenue_by_reseller(queryset.filter(created__lt=today))
+            cache.set(key, closed, settings.REPORT_CACHE_TIMEOUT)
+
+        totals = dict(closed)
+        for username, (cards, revenue) in revenue_by_reseller(queryset.filter(created__gte=today)).items():
+            closed_cards, closed_revenue = totals.get(username, (0, 0))
+            totals[username] = (closed_cards + cards, closed_revenue + revenue)
+
+        resellers = sorted(
+            (
+                {"username": username, "cards": cards, "revenue": revenue}
+                for username, (cards, revenue) in totals.items()
+            ),
+            key=lambda row: row["revenue"], reverse=True,
+        )
+        return Response({
+            "total_revenue": sum(row["revenue"] for row in resellers),
+            "total_cards": sum(row["cards"] for row in resellers),
+            "resellers": resellers,
+        })
 
-class TransactionSet(viewsets.GenericViewSet):
-    queryset = Order.objects.all()
+    @swagger_auto_schema(
+        operation_description="Stream order lines or orders as CSV or NDJSON",
+        manual_parameters=[
+            *ORDER_LINE_FILTERS,
+            openapi.Parameter(
+                "kind",
+                openapi.IN_QUERY,
+                description="'lines' (default) or 'orders'",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "file_format",
+                openapi.IN_QUERY,
+                description="'csv' (default) or 'ndjson'",
+                type=openapi.TYPE_STRING,
+            ),
+        ],
+        responses={200: "Export"},
+    )
+    @action(detail=False, methods=["get"], filter_backends=[], pagination_class=None)
+    def export(self, request):
+        kind = request.query_params.get("kind", "lines")
+        file_format = request.query_params.get("file_format", "csv")
+        if kind not in EXPORTS:
+            raise drf_exceptions({"kind": f"Choose one of: {', '.join(EXPORTS)}."})
+        if file_format not in FORMATS:
+            raise drf_exceptions({"file_format": f"Choose one of: {', '.join(FORMATS)}."})
+
+        queryset = filter_order_lines(export_queryset(kind), request.query_params)
+        response = StreamingHttpResponse(
+            stream_export(kind, file_format, queryset), content_type=FORMATS[file_format])
+        response["Content-Disposition"] = f'attachment; filename="{kind}.{file_format}"'
+        return response
+
+
+def revenue_by_reseller(order_lines):
+    """{username: (cards, revenue)} for the given order lines, in one GROUP BY."""
+    rows = (
+        order_lines.order_by()
+        .values_list("created_by__username")
+        .annotate(cards=Count("id"), revenue=Sum("order__unit_price"))
+    )
+    return {username: (cards, revenue or 0) for username, cards, revenue in rows}
+
+
+class TransactionSet(ServerTimingMixin, viewsets.GenericViewSet):
+    queryset = Order.for_display()
     serializer_class = OrderSerializer
     filter_backends = [filters.SearchFilter]
     pagination_class = CustomPagination
@@ -307,21 +696,22 @@ class TransactionSet(viewsets.GenericViewSet):
     def create(self, request, *args, **kwargs):
         transaction_id = request.data.get("transaction_id")
 
-        order = Order.objects.filter(transaction_id=transaction_id)
+        with phase("lookup"):
+            # Transaction ids are unique per client only.
+            order = self.get_queryset().filter(
+                created_by=request.user, transaction_id=transaction_id).first()
 
-        if not order.exists():
+        if order is None:
             return Response({
                 "status": False,
                 "message": "Transaction not found",
             })
 
-        order = order.first()
-
         return Response(OrderSerializer(order).data)
 
 
 class NotificationViewSet(
-    viewsets.ModelViewSet
+    ConditionalGetMixin, viewsets.ModelViewSet
 ):
     queryset = Notification.objects.exclude(is_read=True)
     serializer_class = NotificationSerializer
@@ -332,7 +722,23 @@ class NotificationViewSet(
 
     def get_queryset(self):
         return Notification.objects.filter(
-            is_read=False).order_by('-created')
+            is_read=False).select_related("product").order_by('-created')
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: super(NotificationViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: super(NotificationViewSet, self).retrieve(request, *args, **kwargs))
+
+    def get_version_stamp(self, request):
+        # Notifications only change through save() or UPDATEs that set
+        # modified, marking one read included; the count catches deletes.
+        # No Last-Modified: the embedded products and the unread count
+        # change without moving Max(modified), and it has one second
+        # resolution, so If-Modified-Since can't be answered safely.
+        stamp = Notification.objects.aggregate(
+            last_modified=Max("modified"), unread=Count("id", filter=Q(is_read=False)))
+        return f"{stamp['last_modified']}:{stamp['unread']}:{catalog_version()}"
 
     @action(detail=True, methods=["patch"], permission_classes=[permissions.IsAuthenticated])
     def mark_as_read(self, request, pk=None):